@@ -0,0 +1,239 @@
+'''
+Backfill of a pipeline over a date range, split in shards run across a
+process pool. Finished shards are recorded in a checkpoint store so that a
+rerun skips them and only retries what failed.
+
+    python backfill.py stocks --start 2010-01-01 --end 2017-12-31 --symbols MSFT IBM AAPL
+    python backfill.py news --start 2010-01-01 --end 2017-12-31 --workers 2
+    python backfill.py forex --start 2010-01-01 --end 2017-12-31
+
+Shards are symbol x month for stocks, month for news and week for forex.
+'''
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+import argparse
+import calendar
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from cache import ResponseCache
+from credentials import Credentials
+
+
+class CheckpointStore(object):
+    '''
+    SQLite file recording the finished shards of each pipeline
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: SQLite file, created if missing
+        '''
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS shards(
+        pipeline TEXT, shard TEXT, rows INTEGER, seconds REAL, finished REAL,
+        PRIMARY KEY (pipeline, shard))''')
+        self.conn.commit()
+
+    def done(self, pipeline):
+        '''
+        :return: set of the finished shards of a pipeline
+        '''
+        with self.lock:
+            cursor = self.conn.execute('SELECT shard FROM shards WHERE pipeline = ?', (pipeline,))
+            return set(shard for shard, in cursor.fetchall())
+
+    def mark_done(self, pipeline, shard, rows, seconds):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO shards VALUES (?, ?, ?, ?, ?)',
+                              (pipeline, shard, rows, seconds, time.time()))
+            self.conn.commit()
+
+    def reset(self, pipeline):
+        with self.lock:
+            self.conn.execute('DELETE FROM shards WHERE pipeline = ?', (pipeline,))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def months(start_date, end_date):
+    '''
+    :return: (first day, last day) of each calendar month, clipped to the range
+    '''
+    first = start_date.replace(day=1)
+    while first <= end_date:
+        last = first.replace(day=calendar.monthrange(first.year, first.month)[1])
+        yield max(first, start_date), min(last, end_date)
+        first = last + timedelta(1)
+
+
+def weeks(start_date, end_date):
+    '''
+    :return: (monday, sunday) of each week, clipped to the range
+    '''
+    monday = start_date - timedelta(start_date.weekday())
+    while monday <= end_date:
+        yield max(monday, start_date), min(monday + timedelta(6), end_date)
+        monday += timedelta(7)
+
+
+def window_key(first, last):
+    return '{0}..{1}'.format(first, last)
+
+
+def epoch(day):
+    return calendar.timegm(day.timetuple())
+
+
+def make_shards(args):
+    '''
+    :return: list of (shard key, pipeline kwargs) of the backfill
+    '''
+    shards = []
+    if args.pipeline == 'stocks':
+        for symbol in args.symbols:
+            for first, last in months(args.start, args.end):
+                shards.append(('{0}:{1}'.format(symbol, window_key(first, last)),
+                               {'symbol': symbol, 'first': first, 'last': last}))
+    elif args.pipeline == 'news':
+        for first, last in months(args.start, args.end):
+            # The archive API returns whole months
+            shards.append((first.strftime('%Y-%m'), {'first': first, 'last': last}))
+    else:
+        for first, last in weeks(args.start, args.end):
+            shards.append((window_key(first, last), {'first': first, 'last': last}))
+    return shards
+
+
+def make_pipeline(args, shard):
+    '''
+    Pipeline extracting and loading one shard. Rate limits are split
+    between the worker processes. Workers only import the pipeline they run
+    '''
+    cache = None if args.no_cache else ResponseCache(os.path.expanduser(args.cache))
+    options = {'cache': cache, 'batch_size': args.batch_size, 'load_mode': args.load_mode}
+    first, last = shard['first'], shard['last']
+    if args.pipeline == 'stocks':
+        from stock_etl import StockETL
+        # Bars before the shard only feed the pct changes and indicators,
+        # lookback_days() covers the weekends and holidays before it
+        return StockETL([shard['symbol']], args.interval, args.market, args.period,
+                        requests_per_second=2.0 / args.workers, indicators=args.indicators,
+                        start_date=first - timedelta(args.lookback_days), end_date=last,
+                        load_after={shard['symbol']: epoch(first) - 1}, **options)
+    if args.pipeline == 'news':
+        from news_etl import NewsETL
+        return NewsETL(Credentials.NTYIMTES_API_KEY, first.year, first.month, last.year, last.month,
+                       requests_per_second=5 / 60.0 / args.workers, **options)
+    from forex_etl import ForexETL
+    # Days before the shard only feed its first rates and delta
+    return ForexETL(first - timedelta(ForexETL.HISTORY_DAYS), last,
+                    requests_per_second=5.0 / args.workers,
+                    load_after=first - timedelta(1), **options)
+
+
+def run_shard(args, key, shard):
+    '''
+    Runs in a worker process
+    :return: (shard key, rows loaded, seconds)
+    '''
+    start = time.perf_counter()
+    pipeline = make_pipeline(args, shard)
+    pipeline.run()
+    rows = pipeline.metrics.stages.get('load', {}).get('rows_in', 0)
+    return key, rows, time.perf_counter() - start
+
+
+def backfill(args):
+    '''
+    :return: dict shard key -> exception of the failed shards
+    '''
+    store = CheckpointStore(os.path.expanduser(args.checkpoints))
+    if args.restart:
+        store.reset(args.pipeline)
+    shards = make_shards(args)
+    done = store.done(args.pipeline)
+    todo = [(key, shard) for key, shard in shards if key not in done]
+    logging.warning('Backfill of {0}: {1} shards, {2} already done'.format(
+        args.pipeline, len(shards), len(shards) - len(todo)))
+    failed = {}
+    start = time.perf_counter()
+    if todo:
+        # Shards starting together would all run the DDL of a missing table
+        # or partition, so the tables of the whole range are created first
+        whole = {'symbol': args.symbols[0], 'first': args.start, 'last': args.end}
+        make_pipeline(args, whole).create_tables(args.start, args.end)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = dict((executor.submit(run_shard, args, key, shard), key) for key, shard in todo)
+        for i, future in enumerate(as_completed(futures)):
+            key = futures[future]
+            try:
+                _, rows, seconds = future.result()
+            except Exception as e:
+                logging.warning('Shard {0} of {1} failed: {2!r}'.format(key, args.pipeline, e))
+                failed[key] = e
+                continue
+            store.mark_done(args.pipeline, key, rows, seconds)
+            logging.warning('Shard {0} done, {1} rows in {2:.1f}s ({3}/{4})'.format(
+                key, rows, seconds, i + 1, len(todo)))
+    store.close()
+    logging.warning('Backfill of {0} ran {1} shards in {2:.1f}s, {3} failed'.format(
+        args.pipeline, len(todo), time.perf_counter() - start, len(failed)))
+    return failed
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Sharded, resumable backfill of a pipeline')
+    parser.add_argument('pipeline', choices=['stocks', 'news', 'forex'])
+    parser.add_argument('--start', type=parse_date, required=True, help='first day, YYYY-MM-DD')
+    parser.add_argument('--end', type=parse_date, default=date.today(), help='last day, YYYY-MM-DD')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes, API rate limits are split between them')
+    parser.add_argument('--checkpoints', default='~/.cache/etl-finance/backfill.sqlite',
+                        help='SQLite file of the finished shards')
+    parser.add_argument('--restart', action='store_true', help='forget the finished shards first')
+    parser.add_argument('--cache', default='~/.cache/etl-finance', help='response cache folder')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--load-mode', choices=['executemany', 'infile'], default='executemany')
+    stocks = parser.add_argument_group('stocks')
+    stocks.add_argument('--symbols', nargs='+', default=['MSFT', 'INTL', 'FB', 'IBM', 'GOOG', 'AAPL'])
+    stocks.add_argument('--interval', default='86400', help='bar size in seconds')
+    stocks.add_argument('--market', default='NASDAQ')
+    stocks.add_argument('--indicators', nargs='*', default=[])
+    args = parser.parse_args(argv)
+    if args.start > args.end:
+        parser.error('--start cannot be after --end')
+    # Days of bars needed before a stock shard to fill the indicator windows
+    args.lookback_days = 0
+    if args.pipeline == 'stocks':
+        from stock_etl import StockETL
+        args.lookback_days = StockETL([], args.interval, args.market, None,
+                                      indicators=args.indicators).lookback_days()
+    # Google Finance periods count back from today. Every shard of a symbol
+    # asks for the same period so they share one cached download
+    args.period = '{}d'.format((date.today() - args.start).days + 1 + args.lookback_days)
+    return args
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(message)s')
+    failed = backfill(parse_args())
+    if failed:
+        logging.warning('Failed shards, rerun to retry them: {}'.format(', '.join(sorted(failed))))
+        sys.exit(1)
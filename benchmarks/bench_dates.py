@@ -0,0 +1,70 @@
+'''
+Micro-benchmark of the date normalization stage on NYTimes style
+pub_date strings.
+
+    python benchmarks/bench_dates.py --rows 1000000
+    python benchmarks/bench_dates.py --rows 1000000 --old-rows 20000
+
+The old per-row apply is timed on --old-rows and extrapolated because it
+takes minutes on a million rows.
+'''
+import argparse
+from datetime import datetime
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from etl import NewsETL
+
+
+def make_dates(rows):
+    seconds = np.random.RandomState(0).randint(1483228800, 1514764800, rows)
+    return pd.Series(pd.to_datetime(seconds, unit='s').strftime('%Y-%m-%dT%H:%M:%S+0000'))
+
+
+def old_normalization(column):
+    # What to_date, to_timestamp and insert_to_db used to do
+    short_date = column.apply(lambda x: pd.to_datetime(x).strftime('%d-%m-%Y'))
+    timestamp = column.apply(lambda x: pd.to_datetime(x)).values.astype('datetime64[s]').astype(np.int64)
+    short_date = short_date.apply(lambda x: datetime.strptime(x, '%d-%m-%Y').date())
+    return short_date, timestamp
+
+
+def new_normalization(pipeline, column):
+    dates = pipeline.parse_dates(column)
+    short_date = pipeline.to_date(dates)
+    timestamp = pipeline.to_timestamp(dates)
+    # Conversion done by the bulk loader
+    short_date = short_date.values.astype('datetime64[D]').tolist()
+    return short_date, timestamp
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--old-rows', type=int, default=20000)
+    args = parser.parse_args()
+    pipeline = NewsETL('', 2017, 1, 2017, 1)
+
+    column = make_dates(args.old_rows)
+    start = time.perf_counter()
+    old_normalization(column)
+    elapsed = time.perf_counter() - start
+    print('per-row apply   {0:>12.0f} rows/sec  ({1:.1f}s extrapolated to {2} rows)'.format(
+        args.old_rows / elapsed, elapsed * args.rows / args.old_rows, args.rows))
+
+    column = make_dates(args.rows)
+    start = time.perf_counter()
+    new_normalization(pipeline, column)
+    elapsed = time.perf_counter() - start
+    print('vectorized      {0:>12.0f} rows/sec  ({1:.1f}s for {2} rows)'.format(
+        args.rows / elapsed, elapsed, args.rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Benchmark of StockETL.transform with rolling indicators on many symbols,
+500 symbols x 10 years of daily bars by default.
+
+    python benchmarks/bench_features.py
+    python benchmarks/bench_features.py --symbols 500 --bars 2520 --indicators ret_20 vol_20 sma_50 vwap_20
+
+The vectorized transform is compared with a loop computing the same
+indicators one symbol at a time.
+'''
+import argparse
+import logging
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from etl import StockETL
+from fakes import FakePriceSource
+
+
+def make_prices(symbols, bars):
+    source = FakePriceSource(bars=bars, latency=0)
+    return pd.concat([source({'q': symbol}).assign(StockName=symbol) for symbol in symbols])
+
+
+def per_symbol_loop(prices, indicators):
+    # One pandas call per symbol and indicator
+    frames = []
+    for _, frame in prices.groupby('StockName', sort=False):
+        frame = frame.copy()
+        previous = frame['Close'].shift(1)
+        frame['pct_change_returns'] = (frame['Open'] / previous - 1).fillna(0)
+        frame['pct_change_volume'] = (frame['Volume'] / frame['Volume'].shift(1) - 1).fillna(0)
+        for name, kind, window in indicators:
+            if kind == 'ret':
+                frame[name] = frame['Close'] / frame['Close'].shift(window) - 1
+            elif kind == 'vol':
+                frame[name] = (frame['Close'] / previous - 1).rolling(window).std()
+            elif kind == 'sma':
+                frame[name] = frame['Close'].rolling(window).mean()
+            elif kind == 'vwap':
+                typical = (frame['High'] + frame['Low'] + frame['Close']) / 3
+                frame[name] = ((typical * frame['Volume']).rolling(window).sum() /
+                               frame['Volume'].rolling(window).sum())
+        frames.append(frame)
+    return pd.concat(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--bars', type=int, default=2520, help='bars per symbol, 2520 is 10 years')
+    parser.add_argument('--indicators', nargs='+', default=['ret_20', 'vol_20', 'sma_50', 'vwap_20'])
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    symbols = ['S{:04d}'.format(i) for i in range(args.symbols)]
+    prices = make_prices(symbols, args.bars)
+    rows = len(prices)
+    pipeline = StockETL(symbols, '86400', 'NASDAQ', '10Y', indicators=args.indicators)
+    print('{0} symbols x {1} bars = {2} rows, indicators {3}'.format(
+        args.symbols, args.bars, rows, ' '.join(args.indicators)))
+
+    start = time.perf_counter()
+    per_symbol_loop(prices, pipeline.indicators)
+    elapsed = time.perf_counter() - start
+    print('per-symbol loop {0:>12.0f} rows/sec  ({1:.2f}s)'.format(rows / elapsed, elapsed))
+
+    pipeline.df = prices.copy()
+    pipeline.clean()
+    start = time.perf_counter()
+    pipeline.transform()
+    elapsed = time.perf_counter() - start
+    print('vectorized      {0:>12.0f} rows/sec  ({1:.2f}s)'.format(rows / elapsed, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''
+Compare rows/sec of the load modes of BulkLoader against the row by row
+INSERT that insert_to_db used to do.
+
+    python benchmarks/bench_load.py --rows 100000
+    python benchmarks/bench_load.py --rows 100000 --mysql
+
+Without --mysql a SQLite in-memory database stands in for MySQL and the
+LOAD DATA LOCAL INFILE mode is skipped.
+'''
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bulk_load import BulkLoader
+from etl import StockETL
+from credentials import Credentials
+
+COLUMNS = [column for column, _ in StockETL.COLUMN_MAPPING]
+
+
+def make_frame(rows):
+    rng = np.random.RandomState(0)
+    close = rng.uniform(10, 500, rows)
+    return pd.DataFrame({
+        'time_stamp': 1483228800 + 86400 * (np.arange(rows) // 100),
+        'stock_name': np.array(['S{:03d}'.format(i) for i in range(100)])[np.arange(rows) % 100],
+        'price_open': close * 0.99, 'price_high': close * 1.01,
+        'price_low': close * 0.98, 'price_close': close,
+        'volume': rng.randint(1000, 10 ** 7, rows),
+        'pct_ret': rng.normal(0, 0.01, rows), 'pct_vol': rng.normal(0, 0.1, rows),
+    })[COLUMNS]
+
+
+def connect(use_mysql):
+    if use_mysql:
+        import pymysql
+        return pymysql.connect(host='localhost', port=3306,
+                               user=Credentials.MYSQL_USER,
+                               passwd=Credentials.MYSQL_PASSWORD,
+                               db=Credentials.MYSQL_DB_NAME,
+                               local_infile=True)
+    return sqlite3.connect(':memory:')
+
+
+def reset_table(conn):
+    cur = conn.cursor()
+    cur.execute('DROP TABLE IF EXISTS bench_stock_ticks')
+    cur.execute('''CREATE TABLE bench_stock_ticks(
+        time_stamp BIGINT, stock_name VARCHAR(6), price_open FLOAT, price_high FLOAT,
+        price_low FLOAT, price_close FLOAT, volume BIGINT, pct_ret FLOAT, pct_vol FLOAT)''')
+    cur.execute('CREATE UNIQUE INDEX idx_bench ON bench_stock_ticks (time_stamp, stock_name)')
+    conn.commit()
+    cur.close()
+
+
+def row_by_row(conn, frame, dialect):
+    loader = BulkLoader(conn, 'bench_stock_ticks', COLUMNS, StockETL.KEY_COLUMNS,
+                        dialect=dialect)
+    sql = loader.upsert_sql()
+    cur = conn.cursor()
+    for row in loader.to_rows(frame):
+        cur.execute(sql, row)
+    conn.commit()
+    cur.close()
+
+
+def bench(name, conn, frame, func):
+    reset_table(conn)
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print('{0:<28} {1:>10.0f} rows/sec  ({2:.2f}s)'.format(name, len(frame) / elapsed, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--mysql', action='store_true',
+                        help='run against the MySQL configured in credentials.py')
+    parser.add_argument('--batch-sizes', default='100,1000,10000')
+    args = parser.parse_args()
+
+    dialect = 'mysql' if args.mysql else 'sqlite'
+    conn = connect(args.mysql)
+    frame = make_frame(args.rows)
+
+    bench('row by row', conn, frame, lambda: row_by_row(conn, frame, dialect))
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        loader = BulkLoader(conn, 'bench_stock_ticks', COLUMNS, StockETL.KEY_COLUMNS,
+                            batch_size=batch_size, dialect=dialect)
+        bench('executemany batch={}'.format(batch_size), conn, frame,
+              lambda: loader.load(frame))
+    if args.mysql:
+        loader = BulkLoader(conn, 'bench_stock_ticks', COLUMNS, StockETL.KEY_COLUMNS,
+                            mode='infile')
+        bench('load data infile', conn, frame, lambda: loader.load(frame))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+'''
+End to end benchmark of StockETL, NewsETL and ForexETL without any live
+service: prices come from FakePriceSource, news and rates from a local
+FakeApiServer, and rows are loaded into a fresh SQLite file (or, with
+--mysql, the database configured in credentials.py, whose tables are
+dropped first). --columnar also loads every chunk into a ColumnarSink.
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --symbols 200 --bars 2520 --months 24 --articles 3000 --days 3650
+    python benchmarks/bench_pipeline.py --save results/baseline.json
+    python benchmarks/bench_pipeline.py --baseline results/baseline.json --tolerance 0.2
+
+Every pipeline runs in streaming mode in a fresh process, so the peak RSS
+reported is its own. Rows/sec are reported per stage from the pipeline
+metrics. With --baseline the results are compared to a file written by
+--save and the exit status is 1 when a stage got slower, or the peak
+memory higher, by more than the tolerance.
+
+With --incremental every pipeline runs twice with incremental=True against
+the same database; the exit status is 1 when the second run fails or
+changes the number of stored rows.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from credentials import Credentials
+from db import get_pool
+from etl import StockETL, NewsETL, ForexETL
+from fakes import FakeApiServer, FakePriceSource
+from http_client import HttpClient
+from metrics import peak_rss
+from storage import ColumnarSink, MySQLBackend, SQLiteBackend
+
+PIPELINES = ['stocks', 'news', 'forex']
+TABLES = {'stocks': ['stock_ticks'], 'news': ['news', 'keywords', 'news_keywords'],
+          'forex': ['forex']}
+# First day of the synthetic news and forex windows
+START = date(2010, 1, 1)
+
+
+def make_pipeline(name, args, url, backends):
+    # Quotas of the real APIs would only measure the rate limiter
+    options = {'backends': backends, 'streaming': True, 'incremental': args.incremental,
+               'http': HttpClient(default_rate=1e6)}
+    if name == 'stocks':
+        symbols = ['S{:04d}'.format(i) for i in range(args.symbols)]
+        return StockETL(symbols, '86400', 'NASDAQ', '10Y',
+                        price_source=FakePriceSource(bars=args.bars, latency=args.latency),
+                        requests_per_second=1e6, indicators=args.indicators, **options)
+    if name == 'news':
+        last = pd.Timestamp(START) + pd.DateOffset(months=args.months - 1)
+        pipeline = NewsETL('bench', START.year, START.month, last.year, last.month,
+                           requests_per_second=1e6, **options)
+        pipeline.URI_ROOT = url + FakeApiServer.NEWS_PATH
+        return pipeline
+    pipeline = ForexETL(START, START + timedelta(args.days - 1), requests_per_second=1e6, **options)
+    pipeline.ROOT_URI_FOREX = url + FakeApiServer.FOREX_PATH
+    pipeline.ROOT_URI_BTC = url + FakeApiServer.BTC_PATH
+    return pipeline
+
+
+def make_backends(name, args, folder):
+    if args.mysql:
+        pool = get_pool(Credentials)
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            for table in TABLES[name]:
+                cur.execute('DROP TABLE IF EXISTS {}'.format(table))
+            conn.commit()
+            cur.close()
+        backends = [MySQLBackend(pool, batch_size=args.batch_size)]
+    else:
+        backends = [SQLiteBackend(os.path.join(folder, '{}.sqlite'.format(name)), batch_size=args.batch_size)]
+    if args.columnar:
+        backends.append(ColumnarSink(os.path.join(folder, 'warehouse')))
+    return backends
+
+
+def run_pipeline(name, args, url):
+    '''
+    Runs in a fresh worker process
+    :return: results of the pipeline, see summarize()
+    '''
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as folder:
+        backends = make_backends(name, args, folder)
+        pipeline = make_pipeline(name, args, url, backends)
+        start = time.perf_counter()
+        pipeline.run()
+        seconds = time.perf_counter() - start
+        results = summarize(pipeline.metrics.stages, seconds, peak_rss())
+        if args.incremental:
+            # The second run only finds data already stored
+            stored = count_rows(backends[0], TABLES[name])
+            make_pipeline(name, args, url, backends).run()
+            results['incremental'] = {'first': stored, 'second': count_rows(backends[0], TABLES[name])}
+    return results
+
+
+def count_rows(backend, tables):
+    '''
+    :return: dict table -> number of rows stored by a SQL backend
+    '''
+    counts = {}
+    with backend.pool.connection() as conn:
+        cur = conn.cursor()
+        for table in tables:
+            cur.execute('SELECT COUNT(*) FROM {}'.format(table))
+            counts[table] = cur.fetchone()[0]
+        cur.close()
+    return counts
+
+
+def summarize(stages, seconds, peak_rss_bytes):
+    '''
+    :param stages: PipelineMetrics.stages of a run
+    :return: dict with the rows/sec of each stage and the peak memory
+    '''
+    results = {'seconds': seconds, 'peak_rss_bytes': peak_rss_bytes, 'stages': {}}
+    for stage, stats in stages.items():
+        if stage == 'total' or not stats['wall_seconds']:
+            continue
+        rows = max(stats['rows_in'], stats['rows_out'])
+        results['stages'][stage] = {'rows': rows, 'seconds': stats['wall_seconds'],
+                                    'rows_per_sec': rows / stats['wall_seconds']}
+    results['rows'] = results['stages'].get('load', {}).get('rows', 0)
+    return results
+
+
+def best(runs):
+    '''
+    Best of the repeated runs of a pipeline, stage by stage
+    '''
+    results = dict(runs[0])
+    results['seconds'] = min(run['seconds'] for run in runs)
+    results['peak_rss_bytes'] = min(run['peak_rss_bytes'] or 0 for run in runs) or None
+    results['stages'] = {}
+    for stage in runs[0]['stages']:
+        stats = [run['stages'][stage] for run in runs if stage in run['stages']]
+        results['stages'][stage] = max(stats, key=lambda stat: stat['rows_per_sec'])
+    return results
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    '''
+    :return: list of the regressions, as printable strings
+    '''
+    regressions = []
+    if baseline.get('sizes') != results['sizes']:
+        print('warning: baseline sizes {0} differ from {1}'.format(baseline.get('sizes'), results['sizes']))
+    print('\n{0:<8} {1:<16} {2:>14} {3:>14} {4:>8}'.format('pipeline', 'stage', 'baseline', 'current', 'ratio'))
+    for name, current in sorted(results['pipelines'].items()):
+        previous = baseline.get('pipelines', {}).get(name)
+        if previous is None:
+            continue
+        for stage, stats in sorted(current['stages'].items()):
+            before = previous['stages'].get(stage)
+            if before is None:
+                continue
+            ratio = stats['rows_per_sec'] / before['rows_per_sec']
+            # Stages this short are mostly noise
+            slow = ratio < 1 - tolerance and max(stats['seconds'], before['seconds']) >= min_seconds
+            print('{0:<8} {1:<16} {2:>10.0f}/s {3:>10.0f}/s {4:>7.2f}x{5}'.format(
+                name, stage, before['rows_per_sec'], stats['rows_per_sec'], ratio, '  SLOWER' if slow else ''))
+            if slow:
+                regressions.append('{0} {1}: {2:.2f}x the baseline rows/sec'.format(name, stage, ratio))
+        if current['peak_rss_bytes'] and previous.get('peak_rss_bytes'):
+            ratio = current['peak_rss_bytes'] / float(previous['peak_rss_bytes'])
+            bigger = ratio > 1 + tolerance
+            print('{0:<8} {1:<16} {2:>12.0f}MB {3:>12.0f}MB {4:>7.2f}x{5}'.format(
+                name, 'peak rss', previous['peak_rss_bytes'] / 2 ** 20, current['peak_rss_bytes'] / 2 ** 20,
+                ratio, '  BIGGER' if bigger else ''))
+            if bigger:
+                regressions.append('{0}: peak RSS {1:.2f}x the baseline'.format(name, ratio))
+    return regressions
+
+
+def report(name, results):
+    print('\n{0}: {1} rows loaded in {2:.2f}s, peak RSS {3:.0f}MB'.format(
+        name, results['rows'], results['seconds'], (results['peak_rss_bytes'] or 0) / 2 ** 20))
+    for stage, stats in sorted(results['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print('  {0:<16} {1:>10} rows {2:>8.2f}s {3:>12.0f} rows/sec'.format(
+            stage, stats['rows'], stats['seconds'], stats['rows_per_sec']))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline end to end benchmark of the pipelines')
+    parser.add_argument('--pipelines', nargs='+', choices=PIPELINES, default=PIPELINES)
+    parser.add_argument('--symbols', type=int, default=50)
+    parser.add_argument('--bars', type=int, default=1260, help='bars per symbol, 252 per year')
+    parser.add_argument('--indicators', nargs='*', default=['ret_20', 'vol_20', 'sma_50', 'vwap_20'])
+    parser.add_argument('--months', type=int, default=12, help='NYTimes archive months')
+    parser.add_argument('--articles', type=int, default=2000, help='articles per archive month')
+    parser.add_argument('--days', type=int, default=730, help='days of forex rates')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per fake API call')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=1, help='runs per pipeline, the best one is kept')
+    parser.add_argument('--mysql', action='store_true', help='load into the database of credentials.py')
+    parser.add_argument('--columnar', action='store_true', help='also load into a Parquet columnar sink')
+    parser.add_argument('--incremental', action='store_true',
+                        help='run every pipeline twice incrementally and check the second run')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file written by --save to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown (or memory growth) counted as a regression, 0.2 is 20%%')
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help='stages shorter than this are not checked against the baseline')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    sizes = dict((key, getattr(args, key)) for key in
+                 ('symbols', 'bars', 'indicators', 'months', 'articles', 'days', 'latency', 'batch_size'))
+    results = {'sizes': sizes, 'time': time.time(), 'database': 'mysql' if args.mysql else 'sqlite',
+               'columnar': args.columnar,
+               'versions': {'python': platform.python_version(), 'pandas': pd.__version__,
+                            'numpy': np.__version__, 'machine': platform.machine()},
+               'pipelines': {}}
+    print('Sizes: {}'.format(', '.join('{0}={1}'.format(key, value) for key, value in sorted(sizes.items()))))
+
+    server = FakeApiServer(articles=args.articles, latency=args.latency).start()
+    # A fresh interpreter per run: peak RSS is not inherited from the others
+    context = multiprocessing.get_context('spawn')
+    try:
+        for name in args.pipelines:
+            runs = []
+            for _ in range(args.repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    runs.append(executor.submit(run_pipeline, name, args, server.url).result())
+            results['pipelines'][name] = best(runs)
+            report(name, results['pipelines'][name])
+    finally:
+        server.stop()
+
+    if args.incremental:
+        changed = [name for name, pipeline in sorted(results['pipelines'].items())
+                   if pipeline['incremental']['first'] != pipeline['incremental']['second']]
+        for name in changed:
+            print('\nIncremental run of {0} changed the stored rows: {1} -> {2}'.format(
+                name, results['pipelines'][name]['incremental']['first'],
+                results['pipelines'][name]['incremental']['second']))
+        if changed:
+            sys.exit(1)
+        print('\nIncremental reruns stored no new rows')
+
+    if args.save:
+        folder = os.path.dirname(args.save)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('\nResults written to {}'.format(args.save))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print('\nRegressions against {0}:\n  {1}'.format(args.baseline, '\n  '.join(regressions)))
+            sys.exit(1)
+        print('\nNo regression against {}'.format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
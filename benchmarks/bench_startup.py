@@ -0,0 +1,113 @@
+'''
+Startup time of the pipelines, each measured in fresh interpreters.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 20
+
+For each pipeline `from etl import <Pipeline>` runs under `python -X importtime`
+and the import time and heaviest modules are printed. Then a forex-only run
+loads a few days from a local FakeApiServer into SQLite, and the exit status
+is 1 when it imported one of FORBIDDEN: the dependencies of the other
+pipelines or of MySQL.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fakes import FakeApiServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PIPELINES = ['ForexETL', 'StockETL', 'NewsETL']
+# Modules a forex-only run must not import
+FORBIDDEN = ['googlefinance', 'pkg_resources', 'aiohttp', 'ijson', 'pymysql', 'dateutil.rrule',
+             'stock_etl', 'news_etl', 'scheduler']
+
+FOREX_RUN = '''
+from datetime import date
+import json
+import logging
+import os
+import sys
+
+logging.disable(logging.WARNING)
+
+from etl import ForexETL
+from http_client import HttpClient
+from storage import SQLiteBackend
+
+url, folder = sys.argv[1:3]
+pipeline = ForexETL(date(2018, 1, 1), date(2018, 1, 10), http=HttpClient(default_rate=1e6),
+                    backends=[SQLiteBackend(os.path.join(folder, 'forex.sqlite'))])
+pipeline.ROOT_URI_FOREX = url + '{forex}'
+pipeline.ROOT_URI_BTC = url + '{btc}'
+pipeline.run()
+print(json.dumps(sorted(sys.modules)))
+'''.format(forex=FakeApiServer.FOREX_PATH, btc=FakeApiServer.BTC_PATH)
+
+
+def run_python(code, *args):
+    '''
+    :return: (seconds, stdout, dict top level module -> cumulative import microseconds)
+    '''
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code] + list(args),
+                             cwd=ROOT, capture_output=True, text=True, check=True)
+    seconds = time.perf_counter() - start
+    modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Nested imports are indented, their time is in the cumulative of their parent
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            modules[name.strip()] = int(cumulative)
+    return seconds, process.stdout, modules
+
+
+def forbidden(modules):
+    return sorted(module for module in modules
+                  if any(module == name or module.startswith(name + '.') for name in FORBIDDEN))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per measure')
+    parser.add_argument('--top', type=int, default=5, help='heaviest modules printed')
+    args = parser.parse_args()
+
+    empty = statistics.median(run_python('pass')[0] for _ in range(args.runs))
+    print('interpreter alone {0:>8.0f}ms'.format(empty * 1000))
+    for name in PIPELINES:
+        runs = [run_python('from etl import {}'.format(name)) for _ in range(args.runs)]
+        seconds = statistics.median(run[0] for run in runs)
+        modules = runs[-1][2]
+        print('\nfrom etl import {0:<12} {1:>6.0f}ms wall, {2:.0f}ms importing'.format(
+            name, seconds * 1000, sum(modules.values()) / 1000.0))
+        for module, micros in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+            print('  {0:<24} {1:>8.1f}ms'.format(module, micros / 1000.0))
+
+    server = FakeApiServer().start()
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            seconds, output, modules = run_python(FOREX_RUN, server.url, folder)
+    finally:
+        server.stop()
+    imported = json.loads(output.splitlines()[-1])
+    print('\nforex-only run {0:>8.0f}ms wall, {1:.0f}ms importing, {2} modules'.format(
+        seconds * 1000, sum(modules.values()) / 1000.0, len(imported)))
+    unexpected = forbidden(imported)
+    if unexpected:
+        print('forex-only run imported {}'.format(', '.join(unexpected)))
+        sys.exit(1)
+    print('forex-only run imported none of {}'.format(', '.join(FORBIDDEN)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+'''
+Local stand-ins for the external data sources used by the benchmarks
+'''
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import calendar
+import json
+import random
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+
+class FakePriceSource(object):
+    '''
+    Callable with the signature of googlefinance.client.get_price_data.
+    Returns synthetic daily bars after a simulated network latency and
+    fails a fraction of the calls.
+    '''
+
+    def __init__(self, bars=500, latency=0.05, failure_rate=0.0, seed=0):
+        self.bars = bars
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def __call__(self, param):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            raise IOError('Fake source failed for {}'.format(param['q']))
+        # crc32 rather than hash(): the same bars in every process
+        rng = np.random.RandomState(zlib.crc32(param['q'].encode()))
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, self.bars)))
+        index = pd.date_range(end=pd.Timestamp('2018-01-01'), periods=self.bars, freq='D')
+        return pd.DataFrame({'Open': close * (1 + rng.normal(0, 0.002, self.bars)),
+                             'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+                             'Volume': rng.randint(10 ** 4, 10 ** 7, self.bars)},
+                            index=index)
+
+
+class FakeApiServer(object):
+    '''
+    Local HTTP server answering like the NYTimes archive, ratesapi.io and
+    coindesk APIs with synthetic documents. The documents only depend on
+    the request, so every run sees the same data.
+
+        server = FakeApiServer(articles=2000).start()
+        pipeline = NewsETL(...)
+        pipeline.URI_ROOT = server.url + server.NEWS_PATH
+    '''
+
+    NEWS_PATH = '/svc/archive/v1'
+    FOREX_PATH = '/api/'
+    BTC_PATH = '/v1/bpi/historical/close.json'
+    NEWS_DESKS = ['Business', 'Foreign', 'Technology', 'Sports', 'Arts', 'World']
+    KEYWORDS = ['Apple Inc', 'Microsoft Corp', 'Banking and Financial Institutions', 'Oil (Petroleum)',
+                'Federal Reserve System', 'Stocks and Bonds', 'Elections', 'China', 'Europe',
+                'Interest Rates', 'Mergers, Acquisitions and Divestitures', 'Bitcoin']
+    CURRENCIES = ['EUR', 'GBP', 'SEK', 'DKK', 'JPY', 'CHF']
+
+    def __init__(self, articles=1000, latency=0.0, port=0):
+        '''
+        :param articles: articles per archive month, a third of them in
+                         desks that NewsETL keeps
+        :param latency: seconds slept before answering each request
+        :param port: port to listen on, 0 picks a free one
+        '''
+        self.articles = articles
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.latency)
+                status, body = server.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-api', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def respond(self, path):
+        '''
+        :return: (status, JSON body) for the path of a request
+        '''
+        parts = urlsplit(path)
+        params = dict((key, values[0]) for key, values in parse_qs(parts.query).items())
+        month = re.match(re.escape(self.NEWS_PATH) + r'/(\d+)/(\d+)\.json$', parts.path)
+        if month:
+            document = self.archive(int(month.group(1)), int(month.group(2)))
+        elif parts.path == self.BTC_PATH:
+            document = self.bpi(params['start'], params['end'])
+        elif parts.path == self.FOREX_PATH + 'history':
+            document = self.history(params['start_at'], params['end_at'], params.get('symbols'))
+        elif re.match(re.escape(self.FOREX_PATH) + r'\d{4}-\d{2}-\d{2}$', parts.path):
+            day = parts.path[len(self.FOREX_PATH):]
+            document = {'base': 'USD', 'date': day, 'rates': self.rates(day)}
+        else:
+            return 404, b'{"error": "not found"}'
+        return 200, json.dumps(document).encode()
+
+    def archive(self, year, month):
+        rng = random.Random(year * 100 + month)
+        seconds = calendar.monthrange(year, month)[1] * 86400
+        start = datetime(year, month, 1)
+        docs = []
+        for i in range(self.articles):
+            published = start + timedelta(seconds=rng.randrange(seconds))
+            keywords = rng.sample(self.KEYWORDS, rng.randint(0, 5))
+            docs.append({'pub_date': published.strftime('%Y-%m-%dT%H:%M:%S+0000'),
+                         'snippet': 'Snippet {0} of {1}-{2:02d} about {3}'.format(
+                             i, year, month, ', '.join(keywords)),
+                         'headline': {'main': 'Headline {0} of {1}-{2:02d}'.format(i, year, month)},
+                         'news_desk': self.NEWS_DESKS[i % len(self.NEWS_DESKS)],
+                         'keywords': [{'name': 'subject', 'value': keyword} for keyword in keywords]})
+        return {'response': {'meta': {'hits': len(docs)}, 'docs': docs}}
+
+    def days(self, start, end):
+        first = datetime.strptime(start, '%Y-%m-%d').date()
+        last = datetime.strptime(end, '%Y-%m-%d').date()
+        return [first + timedelta(i) for i in range((last - first).days + 1)]
+
+    def rates(self, day, symbols=None):
+        # A smooth walk of the rates, the same for a day in every request
+        offset = (datetime.strptime(day, '%Y-%m-%d').date() - date(2000, 1, 1)).days
+        return dict((currency, round((1 + i) * (1 + 0.1 * np.sin(offset / (30.0 + i))), 6))
+                    for i, currency in enumerate(self.CURRENCIES)
+                    if symbols is None or currency in symbols.split(','))
+
+    def history(self, start, end, symbols):
+        # Business days only, like the real API
+        return {'base': 'USD', 'start_at': start, 'end_at': end,
+                'rates': dict((str(day), self.rates(str(day), symbols))
+                              for day in self.days(start, end) if day.weekday() < 5)}
+
+    def bpi(self, start, end):
+        return {'bpi': dict((str(day), round(10000 * (1 + 0.5 * np.sin(day.toordinal() / 50.0)), 4))
+                            for day in self.days(start, end))}
@@ -0,0 +1,150 @@
+import datetime
+import logging
+import os
+import tempfile
+
+import pandas as pd
+
+
+def _csv_field(value):
+    # With ESCAPED BY '' MySQL reads an unquoted NULL as NULL and a quoted
+    # "NULL" as the string, so only strings and dates are enclosed
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (str, datetime.date)):
+        return '"{}"'.format(str(value).replace('"', '""'))
+    return str(value)
+
+
+class BulkLoader(object):
+    '''
+    Bulk upsert of a dataframe into a table. Rows are sent in batches
+    of multi-row INSERT statements (executemany) or, for MySQL, through
+    LOAD DATA LOCAL INFILE from a temporary CSV file.
+    '''
+
+    MODES = ('executemany', 'infile')
+
+    def __init__(self, connection, table_name, columns, key_columns,
+                 batch_size=1000, commit_every=None, mode='executemany',
+                 dialect='mysql'):
+        '''
+        :param connection: DB-API connection (pymysql or sqlite3)
+        :param table_name: target table
+        :param columns: list of table columns, in the order of the frame
+        :param key_columns: columns of the unique index used for upserts
+        :param batch_size: number of rows sent per executemany call
+        :param commit_every: commit after this many rows. None commits once
+        :param mode: 'executemany' or 'infile'
+        :param dialect: 'mysql' or 'sqlite'
+        '''
+        if mode not in self.MODES:
+            raise ValueError('Load mode should be one of {}'.format(self.MODES))
+        if mode == 'infile' and dialect != 'mysql':
+            raise ValueError('LOAD DATA LOCAL INFILE is only supported by MySQL')
+        self.connection = connection
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.key_columns = list(key_columns)
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.mode = mode
+        self.dialect = dialect
+        # executemany batches, LOAD DATA statements and commits sent
+        self.round_trips = 0
+
+    def upsert_sql(self):
+        placeholder = '?' if self.dialect == 'sqlite' else '%s'
+        values = ', '.join([placeholder] * len(self.columns))
+        updates = [c for c in self.columns if c not in self.key_columns]
+        sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            self.table_name, ', '.join(self.columns), values)
+        if not updates:
+            # Every column is part of the key, duplicates are left as they are
+            if self.dialect == 'sqlite':
+                return sql + ' ON CONFLICT ({0}) DO NOTHING'.format(', '.join(self.key_columns))
+            return sql + ' ON DUPLICATE KEY UPDATE {0}={0}'.format(self.key_columns[0])
+        if self.dialect == 'sqlite':
+            sql += ' ON CONFLICT ({0}) DO UPDATE SET {1}'.format(
+                ', '.join(self.key_columns),
+                ', '.join('{0}=excluded.{0}'.format(c) for c in updates))
+        else:
+            sql += ' ON DUPLICATE KEY UPDATE {0}'.format(
+                ', '.join('{0}=VALUES({0})'.format(c) for c in updates))
+        return sql
+
+    def to_rows(self, frame):
+        '''
+        Convert the frame to a list of tuples of plain python values,
+        column by column. NaN becomes None and datetime64 columns become
+        datetime.date because every datetime column we load is a DATE.
+        :param frame: dataframe with the table columns
+        :return: list of tuples
+        '''
+        values = []
+        for column in self.columns:
+            series = frame[column]
+            if pd.api.types.is_datetime64_any_dtype(series):
+                series = series.dt.tz_localize(None) if series.dt.tz else series
+                data = series.values.astype('datetime64[D]').astype(object)
+                data[series.isnull().values] = None
+                values.append(data.tolist())
+            elif series.hasnans:
+                values.append(series.astype(object).where(series.notnull(), None).tolist())
+            else:
+                values.append(series.tolist())
+        return list(zip(*values))
+
+    def load(self, frame):
+        '''
+        Upsert the frame into the table
+        :param frame: dataframe with the table columns
+        :return: number of rows sent
+        '''
+        frame = frame[self.columns]
+        if self.mode == 'infile':
+            return self._load_infile(frame)
+        return self._load_executemany(frame)
+
+    def _load_executemany(self, frame):
+        sql = self.upsert_sql()
+        rows = self.to_rows(frame)
+        cursor = self.connection.cursor()
+        since_commit = 0
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            cursor.executemany(sql, batch)
+            self.round_trips += 1
+            since_commit += len(batch)
+            if self.commit_every and since_commit >= self.commit_every:
+                self.connection.commit()
+                self.round_trips += 1
+                since_commit = 0
+        self.connection.commit()
+        self.round_trips += 1
+        cursor.close()
+        return len(rows)
+
+    def _load_infile(self, frame):
+        # The connection must be opened with local_infile=True
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        try:
+            rows = self.to_rows(frame)
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(','.join(_csv_field(v) for v in row))
+                    f.write('\n')
+            cursor = self.connection.cursor()
+            cursor.execute("LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE {0} "
+                           "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+                           "ESCAPED BY '' LINES TERMINATED BY '\\n' ({1})"
+                           .format(self.table_name, ', '.join(self.columns)),
+                           (path,))
+            self.connection.commit()
+            self.round_trips += 2
+            cursor.close()
+        finally:
+            os.remove(path)
+        logging.warning('Loaded {} rows into {} with LOAD DATA'.format(len(frame), self.table_name))
+        return len(frame)
@@ -0,0 +1,179 @@
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+# Query parameters never used in cache keys, so that rotating a key
+# does not invalidate the cache and keys are not written to disk
+SECRET_PARAMS = ('api-key', 'api_key', 'apikey', 'key', 'token')
+
+
+class ResponseCache(object):
+    '''
+    Content addressed on-disk cache of API responses shared by all
+    pipelines. Entries are keyed by the request URL and parameters
+    without the API key. Entries for closed historical periods are
+    stored as immutable, other entries expire after `ttl` seconds.
+    The cache is bounded to `max_bytes` by evicting the least recently
+    used entries.
+    '''
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, ttl=3600):
+        '''
+        :param directory: folder of the cache, created if missing
+        :param max_bytes: size above which least recently used entries are evicted
+        :param ttl: seconds a mutable entry (current day/month) stays valid
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, url, params=None):
+        '''
+        :return: sha256 of the URL and its sorted query parameters without secrets
+        '''
+        parts = urlsplit(url)
+        query = parse_qsl(parts.query) + sorted((params or {}).items())
+        query = sorted((k, str(v)) for k, v in query if k.lower() not in SECRET_PARAMS)
+        normalized = urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        folder = os.path.join(self.directory, key[:2])
+        return os.path.join(folder, key), os.path.join(folder, key + '.json')
+
+    def _is_fresh(self, meta_path):
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (IOError, ValueError):
+            return False
+        return meta['immutable'] or time.time() - meta['created'] < self.ttl
+
+    def entry_path(self, url, params=None):
+        '''
+        :return: path where the data of the entry is stored, present or not
+        '''
+        return self._paths(self.key(url, params))[0]
+
+    def path(self, url, params=None):
+        '''
+        Path of the cached response, counting a hit or a miss
+        :return: path of the data file or None when missing or expired
+        '''
+        data_path, meta_path = self._paths(self.key(url, params))
+        fresh = os.path.exists(data_path) and self._is_fresh(meta_path)
+        with self.lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not fresh:
+            return None
+        # The mtime of the metadata file orders entries for LRU eviction
+        os.utime(meta_path, None)
+        return data_path
+
+    def get(self, url, params=None):
+        '''
+        :return: cached bytes or None when missing or expired
+        '''
+        path = self.path(url, params)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @contextmanager
+    def writer(self, url, params=None, immutable=False):
+        '''
+        Context manager yielding a binary file to write a response into.
+        The entry only becomes visible when the block exits without error
+        :param immutable: True when the response covers a closed period
+        '''
+        key = self.key(url, params)
+        data_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(data_path))
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                yield f
+            size = os.path.getsize(tmp_path)
+            with open(meta_path, 'w') as f:
+                json.dump({'created': time.time(), 'immutable': immutable, 'size': size}, f)
+            os.replace(tmp_path, data_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._added(size)
+
+    def put(self, url, params, data, immutable=False):
+        with self.writer(url, params, immutable) as f:
+            f.write(data)
+
+    def fetch(self, url, params, download, immutable=False):
+        '''
+        Return the cached response or call download() and cache its result
+        :param download: callable returning the response bytes
+        :param immutable: True when the response covers a closed period
+        :return: response bytes
+        '''
+        data = self.get(url, params)
+        if data is None:
+            data = download()
+            self.put(url, params, data, immutable)
+        return data
+
+    def _entries(self):
+        for folder in os.listdir(self.directory):
+            folder = os.path.join(self.directory, folder)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if name.endswith('.json'):
+                    meta_path = os.path.join(folder, name)
+                    data_path = meta_path[:-len('.json')]
+                    try:
+                        yield (os.path.getmtime(meta_path), data_path, meta_path,
+                               os.path.getsize(data_path))
+                    except OSError:
+                        continue
+
+    def _added(self, size):
+        with self.lock:
+            if self._size is None:
+                self._size = sum(entry[3] for entry in self._entries())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until the cache is 10% under its bound
+        target = self.max_bytes * 0.9
+        for _, data_path, meta_path, size in sorted(self._entries()):
+            if self._size <= target:
+                break
+            for path in (data_path, meta_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size -= size
+            self.evictions += 1
+        logging.warning('Evicted response cache entries, {} bytes left'.format(self._size))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,210 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import asyncio
+import logging
+import random
+import threading
+import time
+
+
+class RateLimiter(object):
+    '''
+    Token bucket limiting calls to a source to `rate` per second,
+    allowing bursts of up to `burst` calls. Safe to share between threads.
+    '''
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError('Rate should be a positive number of calls per second')
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        '''
+        Take a token and return how long the caller has to wait before using it
+        :return: seconds to wait
+        '''
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def pause(self, seconds):
+        '''
+        Hold every caller for at least `seconds`, e.g. after a Retry-After
+        '''
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def backoff_delay(attempt, backoff=1.0, max_backoff=30.0):
+    '''
+    Exponential backoff with full jitter
+    :param attempt: number of the failed attempt, starting at 0
+    :return: seconds to wait before the next attempt
+    '''
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+def call_with_retry(func, args=(), retries=3, backoff=1.0, max_backoff=30.0,
+                    rate_limiter=None, exceptions=(Exception,)):
+    '''
+    Call func(*args), retrying with exponential backoff on failure
+    :param retries: number of retries after the first attempt
+    :param rate_limiter: RateLimiter acquired before every attempt
+    :param exceptions: exceptions that trigger a retry
+    :return: result of func
+    '''
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return func(*args)
+        except exceptions as e:
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(attempt, backoff, max_backoff)
+            logging.warning('{0} failed for {1} ({2}). Retrying in {3:.1f}s'.format(
+                getattr(func, '__name__', func), args, e, delay))
+            time.sleep(delay)
+            attempt += 1
+
+
+class ConcurrentExtractor(object):
+    '''
+    Run fetch(item) for many items on a bounded thread pool. Every item
+    is rate limited and retried on its own, so one slow or failing item
+    does not stop the others.
+    '''
+
+    def __init__(self, fetch, max_workers=4, rate_limiter=None, retries=3,
+                 backoff=1.0, timeout=None, item_timeout=None):
+        '''
+        :param fetch: callable taking one item and returning its result
+        :param max_workers: size of the thread pool
+        :param rate_limiter: RateLimiter shared by all calls to the source
+        :param retries: retries per item
+        :param backoff: base of the exponential backoff in seconds
+        :param timeout: seconds to wait for the whole run. Items still
+                        running after it are reported as failed
+        :param item_timeout: seconds an item may run, retries included. An
+                             item running longer is reported as failed and
+                             its thread is left behind
+        '''
+        self.fetch = fetch
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.item_timeout = item_timeout
+
+    def iter_results(self, items, failures=None, max_pending=None):
+        '''
+        Yield (item, result) pairs as they complete. Items that fail after
+        all retries or time out are logged and stored in `failures`
+        :param items: items to fetch
+        :param failures: optional dict filled with item -> exception
+        :param max_pending: most items submitted and not yet consumed, the
+                            next item is only submitted when a result is
+                            consumed. None submits every item at once
+        '''
+        failures = {} if failures is None else failures
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        waiting = deque(items)
+        futures = {}
+        # Start time of the items picked up by a worker
+        started = {}
+        # Futures of the items that ran out of time, their threads may still be running
+        abandoned = []
+
+        def fetch(item):
+            started[item] = time.monotonic()
+            return call_with_retry(self.fetch, (item,), self.retries, self.backoff,
+                                   rate_limiter=self.rate_limiter)
+
+        def submit():
+            while waiting and (max_pending is None or len(futures) < max_pending):
+                item = waiting.popleft()
+                futures[executor.submit(fetch, item)] = item
+
+        submit()
+        try:
+            while futures:
+                limits = [] if deadline is None else [deadline]
+                if self.item_timeout is not None:
+                    # Items not started yet can run for item_timeout from now at most
+                    limits += [started.get(item, time.monotonic()) + self.item_timeout for item in futures.values()]
+                remaining = None if not limits else max(0, min(limits) - time.monotonic())
+                done, _ = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = futures.pop(future)
+                    try:
+                        yield item, future.result()
+                    except Exception as e:
+                        logging.warning('Giving up on {0}: {1}'.format(item, e))
+                        failures[item] = e
+                    submit()
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                if self.item_timeout is not None:
+                    self.abandon_late(futures, started, abandoned, failures)
+                    if sum(not future.done() for future in abandoned) >= self.max_workers:
+                        logging.warning('Every worker is stuck on an item, giving up on the rest')
+                        break
+                    submit()
+            for item in list(futures.values()) + list(waiting):
+                logging.warning('Timed out waiting for {}'.format(item))
+                failures[item] = TimeoutError('Timed out after {}s'.format(self.timeout or self.item_timeout))
+        finally:
+            running = futures or any(not future.done() for future in abandoned)
+            executor.shutdown(wait=not running, cancel_futures=True)
+
+    def abandon_late(self, futures, started, abandoned, failures):
+        '''
+        Report the items running for more than item_timeout as failed
+        '''
+        now = time.monotonic()
+        for future, item in list(futures.items()):
+            if item in started and now - started[item] >= self.item_timeout:
+                del futures[future]
+                abandoned.append(future)
+                logging.warning('Giving up on {0}: still running after {1}s'.format(item, self.item_timeout))
+                failures[item] = TimeoutError('Still running after {}s'.format(self.item_timeout))
+
+    def run(self, items):
+        '''
+        :param items: items to fetch
+        :return: (dict item -> result, dict item -> exception)
+        '''
+        failures = {}
+        results = dict(self.iter_results(items, failures))
+        return results, failures
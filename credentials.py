@@ -2,6 +2,8 @@
 
 class Credentials:
     
+    MYSQL_HOST = 'localhost' # MySQL runs inside the same Docker image
+    MYSQL_PORT = 3306
     MYSQL_USER = 'root' # this will be remain root since we create it while creating Docker image
     MYSQL_PASSWORD = '123456' # created while creating Docker image
     MYSQL_DB_NAME = 'stock_market' #  you can change it
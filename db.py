@@ -0,0 +1,199 @@
+from contextlib import contextmanager
+import logging
+import queue
+import sqlite3
+import threading
+
+from credentials import Credentials
+
+
+class ConnectionPool(object):
+    '''
+    Pool of MySQL connections borrowed by the pipelines. Connections are
+    opened lazily, checked with a ping when borrowed and kept open between
+    loads. Table existence checks are cached for the life of the process.
+    '''
+
+    # SQL dialect of the connections, for BulkLoader
+    dialect = 'mysql'
+
+    def __init__(self, host, port, user, password, db, size=4, local_infile=False):
+        '''
+        :param size: maximum number of open connections
+        :param local_infile: allow LOAD DATA LOCAL INFILE on the connections
+        '''
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.db = db
+        self.size = size
+        self.local_infile = local_infile
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.tables = set()
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def connect(self):
+        logging.warning('Opening MySQL connection to {0}:{1}'.format(self.host, self.port))
+        self.opened += 1
+        # The driver is only imported by pipelines loading into MySQL
+        import pymysql
+        return pymysql.connect(host=self.host,
+                               port=self.port,
+                               user=self.user,
+                               passwd=self.password,
+                               db=self.db,
+                               local_infile=self.local_infile)
+
+    def acquire(self):
+        '''
+        Borrow a connection, blocking while all of them are in use
+        '''
+        self.slots.acquire()
+        try:
+            try:
+                conn = self.idle.get_nowait()
+                self.check(conn)
+            except queue.Empty:
+                conn = self.connect()
+            return conn
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def check(self, conn):
+        '''
+        Make sure an idle connection still works before lending it
+        '''
+        conn.ping(reconnect=True)
+
+    def release(self, conn, broken=False):
+        if broken:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        else:
+            self.idle.put(conn)
+        self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        '''
+        Context manager borrowing a connection. Uncommitted work is rolled
+        back if the block raises
+        '''
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            try:
+                conn.rollback()
+                self.release(conn)
+            except Exception:
+                self.release(conn, broken=True)
+            raise
+        self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Context manager yielding a cursor, committed when the block succeeds
+        '''
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            finally:
+                cursor.close()
+
+    def table_exists(self, conn, table_name):
+        '''
+        SHOW TABLES only runs the first time a table is checked
+        '''
+        if table_name in self.tables:
+            return True
+        cursor = conn.cursor()
+        self.find_table(cursor, table_name)
+        exists = cursor.fetchone() is not None
+        cursor.close()
+        if exists:
+            self.add_table(table_name)
+        return exists
+
+    def find_table(self, cursor, table_name):
+        cursor.execute('''SHOW TABLES LIKE %s''', (table_name,))
+
+    def add_table(self, table_name):
+        with self.lock:
+            self.tables.add(table_name)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class SQLitePool(ConnectionPool):
+    '''
+    ConnectionPool over a SQLite file, a local stand-in for MySQL in
+    benchmarks and development. Writers wait for each other up to `timeout`
+    seconds instead of failing on a locked database.
+    '''
+
+    dialect = 'sqlite'
+
+    def __init__(self, path, size=4, timeout=60.0):
+        '''
+        :param path: SQLite file, created if missing
+        :param size: maximum number of open connections
+        :param timeout: seconds a writer waits for the database lock
+        '''
+        ConnectionPool.__init__(self, None, None, None, None, path, size=size)
+        self.timeout = timeout
+
+    def connect(self):
+        logging.warning('Opening SQLite database {}'.format(self.db))
+        self.opened += 1
+        # Connections are borrowed by one thread at a time, but not always the same one
+        conn = sqlite3.connect(self.db, timeout=self.timeout, check_same_thread=False)
+        # Readers are not blocked by a load, and a commit needs no fsync of the database
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def check(self, conn):
+        pass
+
+    def find_table(self, cursor, table_name):
+        cursor.execute('''SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?''',
+                       (table_name,))
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(credentials=Credentials, size=4, local_infile=False):
+    '''
+    Pool shared by every pipeline of the process using the same database
+    :param credentials: class with the MYSQL_* settings
+    :return: ConnectionPool
+    '''
+    key = (credentials.MYSQL_HOST, credentials.MYSQL_PORT, credentials.MYSQL_USER,
+           credentials.MYSQL_DB_NAME, local_infile)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(credentials.MYSQL_HOST,
+                                         credentials.MYSQL_PORT,
+                                         credentials.MYSQL_USER,
+                                         credentials.MYSQL_PASSWORD,
+                                         credentials.MYSQL_DB_NAME,
+                                         size=size,
+                                         local_infile=local_infile)
+        return _pools[key]
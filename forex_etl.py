@@ -0,0 +1,207 @@
+from datetime import date, timedelta
+import logging
+
+import pandas as pd
+
+from concurrency import ConcurrentExtractor
+from http_client import CircuitOpenError
+from pipeline import ETLPipeline
+
+
+class ForexETL(ETLPipeline):
+
+    KEY_COLUMNS = ['short_date']
+    DATE_COLUMN = 'short_date'
+    DATE_FORMAT = '%Y-%m-%d'
+    # Days per chunk in streaming mode
+    DEFAULT_CHUNK_SIZE = 31
+    # Days extracted before the first day loaded so that its rates and delta
+    # follow the last quote, over weekends and holidays (e.g. Thursday to
+    # Tuesday over Easter)
+    HISTORY_DAYS = 7
+    # Statuses of the time series endpoint meaning it does not exist
+    RANGE_UNSUPPORTED_STATUSES = (404, 405, 410, 501)
+    STAGING_DTYPES = {'date': 'date32'}
+    STAGING_PARTITIONS = ['year']
+    STAGING_DATE = 'date'
+
+    def __init__(self, start_date, end_date, currencies=('EUR', 'GBP', 'SEK', 'DKK'),
+                 max_workers=4, requests_per_second=5.0, retries=3, **kwargs):
+        '''
+        :param currencies: currencies quoted against USD, one column each
+        :param max_workers: days fetched concurrently when the source has no
+                            time series endpoint
+        :param requests_per_second: rate limit of ratesapi.io
+        :param retries: retries per request, with jittered exponential backoff
+        '''
+        ETLPipeline.__init__(self, table_name='forex', **kwargs)
+        self.ROOT_URI_FOREX = 'https://ratesapi.io/api/'
+        self.ROOT_URI_BTC = 'https://api.coindesk.com/v1/bpi/historical/close.json'
+        self.start_date = start_date
+        self.end_date = end_date
+        self.delta = self.end_date - self.start_date  # timedelta
+        self.currencies = [currency.upper() for currency in currencies]
+        self.max_workers = max_workers
+        self.http.configure(self.ROOT_URI_FOREX, requests_per_second, burst=max_workers, retries=retries)
+        # Set to False once the time series endpoint failed for good, to go day by day
+        self.range_supported = True
+
+        self.rate_columns = ['usd_to_btc'] + ['usd_to_{}'.format(currency.lower())
+                                              for currency in self.currencies]
+        self.COLUMN_MAPPING = ([('short_date', 'date')] +
+                               [(column, column) for column in self.rate_columns] +
+                               [(column + '_delta', column + '_delta') for column in self.rate_columns])
+
+        if self.start_date > self.end_date:
+            raise ValueError('Start date cannot be greater than End date')
+
+
+    def get_range(self, start_date, end_date):
+        '''
+        Rates of a whole date range from the time series endpoint, one request
+        :return: dataframe indexed by business day
+        '''
+        params = {'start_at': str(start_date), 'end_at': str(end_date),
+                  'base': 'USD', 'symbols': ','.join(self.currencies)}
+        response_forex = self.get_json(self.ROOT_URI_FOREX + 'history', params,
+                                       immutable=end_date < date.today())
+        # A range of weekend days or holidays has no rates at all
+        rates = pd.DataFrame.from_dict(response_forex['rates'], orient='index')
+        return rates.reindex(columns=self.currencies)
+
+    def range_unsupported(self, error):
+        '''
+        :return: True when the time series endpoint failed for good: it is
+                 missing or its response has not the expected rates
+        '''
+        if isinstance(error, (KeyError, ValueError)):
+            return True
+        return getattr(getattr(error, 'response', None), 'status_code', None) in self.RANGE_UNSUPPORTED_STATUSES
+
+    def get_day(self, day):
+        # Rates of past days never change
+        response_forex = self.get_json('{0}{1}'.format(self.ROOT_URI_FOREX, day),
+                                       {'base': 'USD'}, immutable=day < date.today())
+
+        # Filter specific currencies we are interested in
+        return [response_forex['rates'][currency] for currency in self.currencies]
+
+    def get_days(self, start_date, end_date):
+        '''
+        Rates fetched one day per request, concurrently
+        :return: dataframe indexed by day
+        :raise RuntimeError: when a business day or every day failed. Only
+                             weekend days are forward filled, a stored gap
+                             would never be fetched again by incremental runs
+        '''
+        days = [start_date + timedelta(i) for i in range((end_date - start_date).days + 1)]
+        # Rate limits and retries are done by the HTTP client
+        extractor = ConcurrentExtractor(self.get_day, max_workers=self.max_workers, retries=0)
+        rates, failed = extractor.run(days)
+        if failed:
+            missing = sorted(day for day in failed if day.weekday() < 5)
+            if missing or not rates:
+                missing = missing or sorted(failed)
+                raise RuntimeError('No rates for {0} days from {1} to {2}: {3!r}'.format(
+                    len(missing), missing[0], missing[-1], failed[missing[0]]))
+            logging.warning('No rates for {} weekend days, they are forward filled'.format(len(failed)))
+        rates = pd.DataFrame.from_dict(dict((str(day), values) for day, values in rates.items()),
+                                       orient='index', columns=self.currencies)
+        return rates
+
+    def get_btc(self, start_date, end_date):
+        params = {'start': str(start_date), 'end': str(end_date), 'currency': 'USD'}
+        btc_data = self.get_json(self.ROOT_URI_BTC, params, immutable=end_date < date.today())
+        return pd.Series(btc_data['bpi'], name='BTC', dtype=float)
+
+    def extract_range(self, start_date, end_date):
+        '''
+        :return: dataframe of the rates between both dates, indexed by every
+                 calendar day. Days without rates are NaN
+        '''
+        rates = None
+        if self.range_supported:
+            try:
+                rates = self.get_range(start_date, end_date)
+            except CircuitOpenError:
+                # ratesapi.io is down, the day by day endpoint would fail too
+                raise
+            except (IOError, KeyError, ValueError) as e:
+                logging.warning('ratesapi.io time series failed ({}). Fetching day by day'.format(e))
+                # Transient errors (timeouts, 5xx after the retries) try the
+                # time series again on the next chunk
+                self.range_supported = not self.range_unsupported(e)
+        if rates is None:
+            rates = self.get_days(start_date, end_date)
+
+        df = pd.concat([self.get_btc(start_date, end_date), rates], axis=1)
+        df.index = pd.to_datetime(df.index, format=self.DATE_FORMAT)
+        df.columns = self.rate_columns
+        return df.reindex(pd.date_range(start_date, end_date, freq='D'))
+
+    def extract(self):
+        self.df = self.extract_range(self.start_date, self.end_date)
+
+    def extract_chunks(self):
+        if not self.chunk_size:
+            yield from ETLPipeline.extract_chunks(self)
+            return
+        chunk_start = self.start_date
+        while chunk_start <= self.end_date:
+            chunk_end = min(chunk_start + timedelta(self.chunk_size - 1), self.end_date)
+            yield self.extract_range(chunk_start, chunk_end)
+            chunk_start = chunk_end + timedelta(1)
+
+    def get_high_water_mark(self, sql_cursor):
+        sql_cursor.execute('''SELECT MAX(short_date) FROM forex''')
+        latest = sql_cursor.fetchone()[0]
+        # MySQL returns a date, SQLite the 'YYYY-MM-DD' string
+        return None if latest is None else pd.Timestamp(latest).date()
+
+    def start_after(self, high_water_mark):
+        if high_water_mark >= self.end_date:
+            return False
+        # Start before the last stored day so the first new day follows a quote
+        self.start_date = max(self.start_date, high_water_mark - timedelta(self.HISTORY_DAYS))
+        self.delta = self.end_date - self.start_date
+        return True
+
+    def drop_loaded(self, high_water_mark):
+        self.df = self.df[self.df['date'] > pd.Timestamp(high_water_mark)]
+
+    def clean(self):
+        logging.warning('Starting to clean FOREX and BTC Data...')
+        self.df = self.df.astype(float)
+        # Markets are closed on weekends and holidays: carry the last known
+        # rates forward, from the previous chunk for the first days
+        self.df = self.df.ffill()
+        if self.carry is not None:
+            self.df = self.df.fillna(self.carry)
+
+
+    def transform(self):
+        logging.warning('Performing data transformation on FOREX and BTC data')
+        # The first day of a chunk is compared to the last day of the previous one
+        previous = self.df.shift(1)
+        if self.carry is not None:
+            previous.iloc[0] = self.carry.values
+        self.carry = self.df.iloc[-1].copy()
+
+        # Making columns for pct change
+        self.df[[column + '_delta' for column in self.rate_columns]] = \
+            (self.df / previous - 1).fillna(0).values
+
+
+        self.df.index.name = 'date'
+        self.df = self.df.reset_index()
+        self.df['date'] = self.parse_dates(self.df['date'])
+
+
+    def setup_table(self, sql_cursor):
+        logging.warning('Setting up TABLES and creating INDEX for forex table')
+        # One rate and one delta column per currency
+        sql_cursor.execute('''CREATE TABLE IF NOT EXISTS forex(
+        short_date DATE, {});'''.format(', '.join('{} FLOAT'.format(column)
+                                                   for column, _ in self.COLUMN_MAPPING[1:])))
+
+        sql_cursor.execute('''CREATE UNIQUE INDEX idx_forex ON forex (short_date) ''')
@@ -0,0 +1,347 @@
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import asyncio
+import logging
+import threading
+import time
+
+from concurrency import RateLimiter, backoff_delay
+
+
+# Statuses worth retrying, other errors are raised right away
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RetryableError(IOError):
+    '''
+    Response with a status worth retrying (429 or 5xx)
+    '''
+
+    def __init__(self, url, status, retry_after=None):
+        IOError.__init__(self, 'HTTP {0} from {1}'.format(status, url))
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(IOError):
+    '''
+    Raised without calling a host whose circuit breaker is open
+    '''
+
+
+def retryable(asynchronous=False):
+    '''
+    Errors retried by the HTTP calls. requests and aiohttp are only imported
+    by the pipelines calling through them
+    :param asynchronous: errors of aiohttp instead of requests
+    '''
+    if asynchronous:
+        import aiohttp
+        return (RetryableError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                asyncio.TimeoutError)
+    import requests
+    return RetryableError, requests.ConnectionError, requests.Timeout
+
+
+def parse_retry_after(value):
+    '''
+    :param value: Retry-After header, seconds or an HTTP date
+    :return: seconds to wait, None when missing or invalid
+    '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker(object):
+    '''
+    Stops calls to a host after `failure_threshold` consecutive failures.
+    After `reset_timeout` seconds one trial call goes through: the circuit
+    closes again if it succeeds and stays open for another period if not.
+    A trial ending without an answer either way (a 429, a cancelled call)
+    is released and the next call is the trial.
+    '''
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, host, failure_threshold=5, reset_timeout=60.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        '''
+        :raise CircuitOpenError: when the host must not be called
+        '''
+        with self.lock:
+            if self.state == self.OPEN:
+                wait = self.opened + self.reset_timeout - time.monotonic()
+                if wait > 0:
+                    raise CircuitOpenError('Circuit of {0} is open for {1:.0f}s more'.format(self.host, wait))
+                self.state = self.HALF_OPEN
+                self.trial = False
+            if self.state == self.HALF_OPEN:
+                if self.trial:
+                    raise CircuitOpenError('Circuit of {} is half open, waiting for the trial call'.format(self.host))
+                self.trial = True
+
+    def release(self):
+        '''
+        End a trial call that neither succeeded nor failed
+        '''
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.trial = False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logging.warning('Circuit of {} closed'.format(self.host))
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning('Circuit of {0} opened after {1} failures'.format(self.host, self.failures))
+                self.state = self.OPEN
+                self.opened = time.monotonic()
+
+
+class Host(object):
+    '''
+    Rate limit and circuit breaker of one host. The rate is halved when the
+    host answers 429 and grows back by a tenth of the quota per success, so
+    throughput stays just under the quota of the provider.
+    '''
+
+    def __init__(self, name, rate, burst=1, retries=3, failure_threshold=5, reset_timeout=60.0):
+        self.name = name
+        self.quota = float(rate)
+        self.limiter = RateLimiter(rate, burst)
+        self.retries = retries
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.throttles = 0
+
+    def configure(self, rate=None, burst=None, retries=None):
+        if rate is not None:
+            self.quota = float(rate)
+            self.limiter.set_rate(rate)
+        if burst is not None:
+            self.limiter.burst = float(burst)
+        if retries is not None:
+            self.retries = retries
+
+    def throttled(self, retry_after=None):
+        self.throttles += 1
+        rate = max(self.quota / 16, self.limiter.rate / 2)
+        logging.warning('{0} is rate limiting us, slowing down to {1:.3f} calls/s'.format(self.name, rate))
+        self.limiter.set_rate(rate)
+        # Everybody waits, not only the call that got the 429
+        self.limiter.pause(retry_after or 1 / rate)
+
+    def succeeded(self):
+        self.breaker.record_success()
+        if self.limiter.rate < self.quota:
+            self.limiter.set_rate(min(self.quota, self.limiter.rate + self.quota / 10))
+
+
+class HttpClient(object):
+    '''
+    HTTP layer shared by the extractors. Every host gets a token bucket
+    rate limit and a circuit breaker. Calls time out, failures (connection
+    errors, timeouts, 429 and 5xx) are retried with jittered exponential
+    backoff and Retry-After headers are honored.
+    '''
+
+    def __init__(self, timeout=30.0, retries=3, backoff=1.0, max_backoff=60.0,
+                 default_rate=10.0, failure_threshold=5, reset_timeout=60.0):
+        '''
+        :param timeout: seconds allowed to connect and between bytes received
+        :param retries: default retries per call, see configure()
+        :param backoff: base of the exponential backoff in seconds
+        :param max_backoff: longest wait between two attempts
+        :param default_rate: calls per second to hosts that were not configured
+        :param failure_threshold: consecutive failures opening the circuit of a host
+        :param reset_timeout: seconds before an open circuit lets a trial call through
+        '''
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.default_rate = default_rate
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def host(self, url):
+        '''
+        :param url: URL or host name
+        :return: Host, created with the default settings the first time
+        '''
+        name = urlsplit(url).netloc or url
+        with self.lock:
+            if name not in self.hosts:
+                self.hosts[name] = Host(name, self.default_rate, retries=self.retries,
+                                        failure_threshold=self.failure_threshold,
+                                        reset_timeout=self.reset_timeout)
+            return self.hosts[name]
+
+    def configure(self, url, rate=None, burst=None, retries=None):
+        '''
+        Set the quota of a host
+        :param url: URL or host name
+        :param rate: calls per second allowed by the provider
+        :param burst: calls that can be made at once
+        :param retries: retries per call to the host
+        '''
+        self.host(url).configure(rate, burst, retries)
+        return self
+
+    def session(self):
+        # requests sessions keep connections alive, one per thread
+        if getattr(self.local, 'session', None) is None:
+            import requests
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def check(self, url, status, headers):
+        if status in RETRY_STATUSES:
+            raise RetryableError(url, status, parse_retry_after(headers.get('Retry-After')))
+
+    def retry_delay(self, host, error, attempt):
+        '''
+        Record a failed attempt
+        :return: seconds to wait before the next attempt, None to give up
+        '''
+        retry_after = getattr(error, 'retry_after', None)
+        if getattr(error, 'status', None) == 429:
+            host.breaker.release()
+            host.throttled(retry_after)
+        else:
+            host.breaker.record_failure()
+            if retry_after:
+                host.limiter.pause(retry_after)
+        if attempt >= host.retries:
+            return None
+        delay = backoff_delay(attempt, self.backoff, self.max_backoff)
+        logging.warning('Call to {0} failed ({1!r}). Retrying in {2:.1f}s'.format(host.name, error, delay))
+        return delay
+
+    def call(self, url, func, args=(), exceptions=(Exception,)):
+        '''
+        Call func(*args) under the rate limit, circuit breaker and retries
+        of a host. Used for sources wrapped by a python client
+        :param url: URL or host name the call goes to
+        :param exceptions: errors that are retried and count as failures
+        :return: result of func
+        '''
+        host = self.host(url)
+        attempt = 0
+        while True:
+            host.breaker.allow()
+            host.limiter.acquire()
+            try:
+                result = func(*args)
+            except exceptions as e:
+                delay = self.retry_delay(host, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except Exception:
+                # The host answered, e.g. with a 404
+                host.breaker.record_success()
+                raise
+            except BaseException:
+                # e.g. KeyboardInterrupt, the host did not answer either way
+                host.breaker.release()
+                raise
+            host.succeeded()
+            return result
+
+    def get(self, url, params=None):
+        '''
+        :return: body of the response
+        :raise requests.HTTPError: on other error statuses
+        '''
+        def request():
+            response = self.session().get(url, params=params, timeout=self.timeout)
+            self.check(url, response.status_code, response.headers)
+            response.raise_for_status()
+            return response.content
+        return self.call(url, request, exceptions=retryable())
+
+    async def get_async(self, session, url, params=None, handle=None):
+        '''
+        GET with an aiohttp session, the whole call including `handle` is retried
+        :param handle: coroutine function taking the response and returning
+                       the result, e.g. to stream the body. Defaults to reading it
+        :return: body of the response or result of handle
+        '''
+        host = self.host(url)
+        errors = retryable(asynchronous=True)
+        attempt = 0
+        while True:
+            host.breaker.allow()
+            await host.limiter.acquire_async()
+            try:
+                async with session.get(url, params=params) as response:
+                    self.check(url, response.status, response.headers)
+                    response.raise_for_status()
+                    result = await (response.read() if handle is None else handle(response))
+            except errors as e:
+                delay = self.retry_delay(host, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except Exception:
+                host.breaker.record_success()
+                raise
+            except BaseException:
+                # Cancelled, e.g. by a timeout of the caller
+                host.breaker.release()
+                raise
+            host.succeeded()
+            return result
+
+    def stats(self):
+        return dict((name, {'rate': host.limiter.rate, 'circuit': host.breaker.state,
+                            'throttles': host.throttles})
+                    for name, host in self.hosts.items())
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    '''
+    Client shared by every pipeline of the process, so that pipelines
+    calling the same host share its quota and circuit breaker
+    :return: HttpClient
+    '''
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
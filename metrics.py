@@ -0,0 +1,177 @@
+from contextlib import contextmanager
+import cProfile
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+COUNTERS = ('calls', 'wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out',
+            'bytes_downloaded', 'requests', 'db_round_trips')
+
+PROMETHEUS_HELP = {
+    'calls': 'Number of times the stage ran',
+    'wall_seconds': 'Wall time spent in the stage',
+    'cpu_seconds': 'CPU time of the thread running the stage',
+    'rows_in': 'Rows handed to the stage',
+    'rows_out': 'Rows produced by the stage',
+    'bytes_downloaded': 'Bytes received from external APIs',
+    'requests': 'Calls to external APIs',
+    'db_round_trips': 'Round trips to the database',
+    'peak_rss_bytes': 'Peak resident memory of the process after the stage',
+}
+
+
+def peak_rss():
+    '''
+    :return: peak resident set size of the process in bytes, None if unknown
+    '''
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PipelineMetrics(object):
+    '''
+    Per stage counters of a pipeline run: wall/CPU time, rows in and out,
+    bytes downloaded, API requests, DB round trips and peak RSS. Stages
+    slower than `profile_threshold` get a cProfile dump, and a tracemalloc
+    top 25 when `trace_memory` is on, written to `output_dir`.
+    '''
+
+    def __init__(self, pipeline, output_dir=None, profile_threshold=None, trace_memory=False):
+        '''
+        :param pipeline: name of the pipeline, used as metric label
+        :param output_dir: folder of the JSON, Prometheus textfile and profile dumps
+        :param profile_threshold: seconds above which a stage profile is dumped.
+                                  None disables profiling
+        :param trace_memory: also dump the top allocations of slow stages
+        '''
+        self.pipeline = pipeline
+        self.output_dir = output_dir
+        self.profile_threshold = profile_threshold
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = dict((counter, 0) for counter in COUNTERS)
+            self.stages[name]['peak_rss_bytes'] = None
+        return self.stages[name]
+
+    def add(self, stage, **counters):
+        '''
+        Add to the counters of a stage, e.g. add('extract', bytes_downloaded=512, requests=1)
+        '''
+        with self.lock:
+            stats = self._stage(stage)
+            for counter, value in counters.items():
+                stats[counter] += value
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Context manager measuring one run of a stage. Yields a dict in which
+        the caller can set rows_in and rows_out
+        '''
+        rows = {'rows_in': 0, 'rows_out': 0}
+        profiler = self._start_profile()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield rows
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            self.add(name, calls=1, wall_seconds=wall, cpu_seconds=cpu, **rows)
+            with self.lock:
+                self._stage(name)['peak_rss_bytes'] = peak_rss()
+            self._stop_profile(name, profiler, wall)
+
+    def _start_profile(self):
+        if self.profile_threshold is None:
+            return None
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active, e.g. a stage running on an other thread
+            return None
+        return profiler
+
+    def _stop_profile(self, name, profiler, wall):
+        if profiler is None:
+            return
+        profiler.disable()
+        if wall < self.profile_threshold:
+            return
+        output_dir = self.output_dir or tempfile.gettempdir()
+        os.makedirs(output_dir, exist_ok=True)
+        # One dump per run of the stage, e.g. news-extract-3.prof for the third chunk
+        prefix = os.path.join(output_dir, '{0}-{1}-{2}'.format(self.pipeline, name,
+                                                                self.stages[name]['calls']))
+        profiler.dump_stats(prefix + '.prof')
+        logging.warning('Stage {0} of {1} took {2:.2f}s, profile written to {3}.prof'.format(
+            name, self.pipeline, wall, prefix))
+        if self.trace_memory and tracemalloc.is_tracing():
+            with open(prefix + '.tracemalloc.txt', 'w') as f:
+                for stat in tracemalloc.take_snapshot().statistics('lineno')[:25]:
+                    f.write('{}\n'.format(stat))
+
+    def timings(self):
+        return dict((name, stats['wall_seconds']) for name, stats in self.stages.items())
+
+    def to_json(self):
+        return json.dumps({'pipeline': self.pipeline, 'time': time.time(), 'stages': self.stages},
+                          sort_keys=True)
+
+    def to_prometheus(self):
+        '''
+        :return: the metrics in the Prometheus text exposition format
+        '''
+        lines = []
+        for counter in COUNTERS + ('peak_rss_bytes',):
+            metric = 'etl_stage_{}'.format(counter)
+            lines.append('# HELP {0} {1}'.format(metric, PROMETHEUS_HELP[counter]))
+            lines.append('# TYPE {} gauge'.format(metric))
+            for name, stats in sorted(self.stages.items()):
+                if stats[counter] is not None:
+                    lines.append('{0}{{pipeline="{1}",stage="{2}"}} {3}'.format(
+                        metric, self.pipeline, name, stats[counter]))
+        return '\n'.join(lines) + '\n'
+
+    def _write(self, name, content):
+        # Write then rename, the textfile collector must never read half a file
+        path = os.path.join(self.output_dir, name)
+        handle, tmp_path = tempfile.mkstemp(dir=self.output_dir)
+        with os.fdopen(handle, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def emit(self):
+        '''
+        Log the metrics as a JSON line and, with an output_dir, write
+        <pipeline>.json and <pipeline>.prom for the node exporter textfile collector
+        '''
+        logging.warning(self.to_json())
+        if self.output_dir is None:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._write('{}.json'.format(self.pipeline), self.to_json() + '\n')
+        self._write('{}.prom'.format(self.pipeline), self.to_prometheus())
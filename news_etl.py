@@ -0,0 +1,378 @@
+from dateutil.rrule import rrule, MONTHLY
+from datetime import datetime, date
+import asyncio
+import json
+import logging
+
+import aiohttp
+import ijson
+import numpy as np
+import pandas as pd
+
+from pipeline import ETLPipeline
+
+
+class NewsETL(ETLPipeline):
+
+    '''
+    NEWS_DESK_VALUES = ['Adventure Sports', 'Arts & Leisure', 'Arts', 'Automobiles', 'Blogs', 'Books',
+            'Booming', 'Business Day', 'Business', 'Cars', 'Circuits', 'Classifieds', 'Connecticut', 'Crosswords & Games',
+             'Culture', 'DealBook', 'Dining', 'Editorial', 'Education', 'Energy', 'Entrepreneurs', 'Environment', 'Escapes',
+             'Fashion & Style', 'Fashion', 'Favorites', 'Financial', 'Flight', 'Food', 'Foreign', 'Generations', 'Giving',
+             'Global Home', 'Health & Fitness', 'Health', 'Home & Garden', 'Home', 'Jobs', 'Key', 'Letters', 'Long Island',
+             'Magazine', 'Market Place', 'Media', "Men's Health", 'Metro', 'Metropolitan', 'Movies', 'Museums', 'National',
+            'Nesting', 'Obits', 'Obituaries', 'Obituary', 'OpEd', 'Opinion', 'Outlook', 'Personal Investing', 'Personal Tech',
+            'Play', 'Politics', 'Regionals', 'Retail', 'Retirement', 'Science', 'Small Business', 'Society', 'Sports', 'Style',
+            'Sunday Business', 'Sunday Review', 'Sunday Styles', 'T Magazine', 'T Style', 'Technology', 'Teens', 'Television',
+            'The Arts', 'The Business of Green', 'The City Desk', 'The City', 'The Marathon', 'The Millennium',
+            'The Natural World', 'The Upshot', 'The Weekend', 'The Year in Pictures', 'Theater', 'Then & Now', 'Thursday Styles',
+             'Times Topics', 'Travel', 'U.S.', 'Universal', 'Upshot', 'UrbanEye', 'Vacation', 'Washington', 'Wealth', 'Weather',
+            'Week in Review', 'Week', 'Weekend', 'Westchester', 'Wireless Living', "Women's Health", 'Working',
+            'Workplace', 'World', 'Your Money']
+
+    SECTION_FIELDS = ['Arts', 'Automobiles', 'Autos', 'Blogs', 'Books', 'Booming', 'Business', 'Business Day',
+            'Corrections', 'Crosswords & Games', 'Crosswords/Games', 'Dining & Wine', 'Dining and Wine',
+            "Editors' Notes", 'Education', 'Fashion & Style', 'Food', 'Front Page', 'Giving', 'Global Home',
+             'Great Homes & Destinations', 'Great Homes and Destinations', 'Health', 'Home & Garden',
+            'Home and Garden', 'International Home', 'Job Market', 'Learning', 'Magazine', 'Movies',
+            'Multimedia', 'Multimedia/Photos', 'N.Y. / Region', 'N.Y./Region', 'NYRegion', 'NYT Now',
+            'National', 'New York', 'New York and Region', 'Obituaries', 'Olympics', 'Open', 'Opinion',
+            'Paid Death Notices', 'Public Editor', 'Real Estate', 'Science', 'Sports', 'Style', 'Sunday Magazine',
+             'Sunday Review', 'T Magazine', 'T:Style', 'Technology', 'The Public Editor', 'The Upshot', 'Theater',
+            'Times Topics', 'TimesMachine', "Today's Headlines", 'Topics', 'Travel', 'U.S.', 'Universal',
+             'UrbanEye', 'Washington', 'Week in Review', 'World', 'Your Money']
+    '''
+
+    COLUMN_MAPPING = [('time_stamp', 'timestamp'), ('short_date', 'short_date'),
+                      ('snippet', 'snippet'), ('headline', 'headline'),
+                      ('keywords', 'keywords'), ('news_id', 'news_id')]
+    KEY_COLUMNS = ['time_stamp', 'headline']
+    # Partitions must be on a column of the unique index
+    DATE_COLUMN = 'time_stamp'
+    EPOCH_DATES = True
+    # Longest keyword stored in the keywords table
+    MAX_KEYWORD_LENGTH = 255
+
+    # Selected few fields randomly which can impact the finance industry
+    IMPORTANT_FIELDS = ['Business', 'Foreign', 'Business Day', 'Financial',
+                        'National', 'Small Business', 'Technology', 'World']
+    URI_ROOT = 'https://api.nytimes.com/svc/archive/v1'
+    # Months per chunk in streaming mode
+    DEFAULT_CHUNK_SIZE = 1
+    # pub_date, e.g. 2017-01-01T05:00:00+0000
+    DATE_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+    STAGING_DTYPES = {'short_date': 'date32'}
+    STAGING_PARTITIONS = ['month']
+    STAGING_DATE = 'short_date'
+
+    def __init__(self, api_key, start_year, start_month, end_year, end_month,
+                 max_concurrency=4, requests_per_second=5 / 60.0, timeout=300,
+                 retries=3, **kwargs):
+        '''
+        :param max_concurrency: number of months downloaded at the same time
+        :param requests_per_second: rate cap of the NYTimes API (5 calls per minute)
+        :param timeout: seconds allowed to download one month
+        :param retries: retries per month, with jittered exponential backoff
+        '''
+        ETLPipeline.__init__(self, table_name='news', **kwargs)
+        self.api_key = api_key
+        self.start_year = start_year
+        self.start_month = start_month
+        self.end_year = end_year
+        self.end_month = end_month
+        self.max_concurrency = max_concurrency
+        self.http.configure(self.URI_ROOT, requests_per_second, burst=max_concurrency, retries=retries)
+        self.timeout = timeout
+        self.failed_months = {}
+
+        if(start_year > end_year):
+            raise ValueError('Start Year cannot be greater than End Year')
+        if(12 <= start_month <= 0 and 12 <= start_month <= 0):
+            raise ValueError('Month value should be between 1 and 12. 1=January and 12=December')
+
+
+
+    def getMonthsBetween(self):
+        start_date_string = '{0}/{1}'.format(self.start_month, self.start_year)
+        end_date_string = '{0}/{1}'.format(self.end_month, self.end_year)
+
+        start_date = datetime.strptime(start_date_string, '%m/%Y')
+        end_date = datetime.strptime(end_date_string, '%m/%Y')
+
+        months_diff = [[dt.strftime("%m"), dt.strftime("%Y")] for dt in
+                  rrule(MONTHLY, dtstart=start_date, until=end_date)]
+
+        return months_diff
+
+
+
+    def is_important(self, news):
+        # news['news_desk'] is a field which returns the news category.
+        # Older archive months spell it 'new_desk'
+        desk = news['new_desk'] if 'new_desk' in news else news.get('news_desk')
+        return desk in self.IMPORTANT_FIELDS
+
+    def to_row(self, news):
+        return (news['pub_date'],
+                news['snippet'],
+                news['headline']['main'],
+                [i['value'] for i in news['keywords']])
+
+    def parse_month(self, path):
+        '''
+        Parse the docs of a cached archive month one by one
+        :return: list of (pub_date, snippet, headline, keywords) tuples
+        '''
+        with open(path, 'rb') as f:
+            return [self.to_row(news) for news in ijson.items(f, 'response.docs.item')
+                    if self.is_important(news)]
+
+    async def get_month(self, session, semaphore, year, month):
+        '''
+        Download one archive month and parse its docs while they stream in,
+        keeping only the important news. With a cache the month is streamed
+        to disk first and parsed from there
+        :return: list of (pub_date, snippet, headline, keywords) tuples
+        '''
+        url = '{0}/{1}/{2}.json'.format(self.URI_ROOT, int(year), int(month))
+        params = {'api-key': self.api_key}
+        # Past months never change
+        today = date.today()
+        immutable = (int(year), int(month)) < (today.year, today.month)
+        async with semaphore:
+            path = None if self.cache is None else self.cache.path(url, params)
+            if path is None:
+                logging.warning('Getting news for {0}-{1}'.format(year, month))
+
+                async def parse(response):
+                    data = [self.to_row(news) async for news in
+                            ijson.items(response.content, 'response.docs.item')
+                            if self.is_important(news)]
+                    self.metrics.add('extract', requests=1,
+                                     bytes_downloaded=response.content.total_bytes)
+                    return data
+
+                async def store(response):
+                    with self.cache.writer(url, params, immutable) as f:
+                        async for chunk in response.content.iter_chunked(1 << 16):
+                            f.write(chunk)
+                    self.metrics.add('extract', requests=1,
+                                     bytes_downloaded=response.content.total_bytes)
+
+                # Rate limit, retries and circuit breaker of the HTTP client
+                if self.cache is None:
+                    return await self.http.get_async(session, url, params, parse)
+                await self.http.get_async(session, url, params, store)
+                path = self.cache.entry_path(url, params)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.parse_month, path)
+
+    async def get_months(self, months):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            return await asyncio.gather(*[self.get_month(session, semaphore, year, month)
+                                          for month, year in months],
+                                        return_exceptions=True)
+
+    def extract_months(self, months):
+        '''
+        :param months: [month, year] pairs as returned by getMonthsBetween()
+        :return: dataframe of the news of the months before the first one
+                 that failed, None if there are none. Later months are not
+                 loaded, so that the high water mark stays before the gap
+        '''
+        results = asyncio.run(self.get_months(months))
+        frames = []
+        for (month, year), data in zip(months, results):
+            if isinstance(data, Exception):
+                logging.warning('Could not get news for {0}-{1}: {2!r}'.format(year, month, data))
+                self.failed_months[(year, month)] = data
+            elif not self.failed_months:
+                frames.append(pd.DataFrame(data, columns=['pub_date', 'snippet', 'headline', 'keywords']))
+        if not frames:
+            return None
+        return pd.concat(frames, ignore_index=True)
+
+    def extract(self):
+        logging.warning('Extracting news data from NYTimes API')
+        months = self.getMonthsBetween()
+        self.failed_months = {}
+        self.df = self.extract_months(months)
+        if self.df is None:
+            raise RuntimeError('Could not get news for {}'.format(self.describe_failures()))
+
+    def extract_chunks(self):
+        '''
+        Months before the first failed one are loaded, then the run fails
+        '''
+        if not self.chunk_size:
+            yield from ETLPipeline.extract_chunks(self)
+        else:
+            logging.warning('Extracting news data from NYTimes API, {} months at a time'.format(self.chunk_size))
+            months = self.getMonthsBetween()
+            self.failed_months = {}
+            for i in range(0, len(months), self.chunk_size):
+                df = self.extract_months(months[i:i + self.chunk_size])
+                if df is not None:
+                    yield df
+                if self.failed_months:
+                    break
+        if self.failed_months:
+            raise RuntimeError('Could not get news for {}, the following months were not loaded'.format(
+                self.describe_failures()))
+
+    def describe_failures(self):
+        return ', '.join('{0}-{1} ({2!r})'.format(year, month, error)
+                         for (year, month), error in sorted(self.failed_months.items()))
+
+
+    def get_high_water_mark(self, sql_cursor):
+        sql_cursor.execute('''SELECT MAX(time_stamp) FROM news''')
+        return sql_cursor.fetchone()[0]
+
+    def start_after(self, high_water_mark):
+        latest = datetime.utcfromtimestamp(high_water_mark)
+        if (latest.year, latest.month) > (self.end_year, self.end_month):
+            return False
+        if (latest.year, latest.month) > (self.start_year, self.start_month):
+            self.start_year, self.start_month = latest.year, latest.month
+        return True
+
+    def drop_loaded(self, high_water_mark):
+        # Articles published in the same second as the last stored one are
+        # kept, the upsert takes care of the ones already stored
+        self.df = self.df[self.df['timestamp'] >= high_water_mark]
+
+    def clean(self):
+        logging.warning('Starting to clean news data...')
+        # Convert string columns to lowercase
+        # Filter empty snippet and headline rows first, with a single copy
+        self.df = self.df[(self.df['snippet'] != '') & (self.df['headline'] != '')]
+        self.df['snippet'] = self.df['snippet'].str.lower()
+        self.df['headline'] = self.df['headline'].str.lower()
+
+        # Keywords are normalized as one exploded column with vectorized
+        # string operations, then grouped back into one list per article
+        keywords = self.df['keywords'].explode().dropna().astype(str)
+        keywords = keywords.str.strip().str.lower().str.slice(0, self.MAX_KEYWORD_LENGTH)
+        keywords = keywords[keywords != '']
+        keywords = keywords[~keywords.reset_index().duplicated().values]
+        labels, starts = self.group_starts(keywords)
+        groups = np.split(keywords.values.astype(object), starts[1:]) if len(starts) else []
+        lists = pd.Series(groups, index=labels, dtype=object).reindex(self.df.index)
+        for i in np.flatnonzero(lists.isnull().values):
+            lists.iat[i] = []
+        self.df['keywords'] = lists
+
+
+    def transform(self):
+        logging.warning('Performing data transformation on news data')
+
+        # Creating date columns with timestamp and short date
+        dates = self.parse_dates(self.df['pub_date'])
+        self.df['short_date'] = self.to_date(dates)
+        self.df['timestamp'] = self.to_timestamp(dates)
+
+        # Delete Date column b/c it is not required now
+        del self.df['pub_date']
+
+        # The same article can be listed twice in a month, only the last one is loaded
+        self.df = self.df.drop_duplicates(['timestamp', 'headline'], keep='last')
+        self.df['news_id'] = self.hash_ids(self.df[['timestamp', 'headline']])
+
+    def hash_ids(self, values):
+        '''
+        Deterministic 63 bit ids, the same in every run and process
+        :param values: series or dataframe, one id per row
+        :return: int64 array
+        '''
+        hashes = pd.util.hash_pandas_object(values, index=False).values
+        return (hashes & np.uint64(0x7FFFFFFFFFFFFFFF)).astype(np.int64)
+
+    def keyword_pairs(self):
+        '''
+        Inverted index of the keywords of self.df
+        :return: dataframe of keyword_id, news_id, time_stamp and keyword,
+                 one row per keyword of an article, indexed like self.df
+        '''
+        keywords = self.df['keywords'].explode().dropna()
+        pairs = pd.DataFrame({'news_id': self.df['news_id'].reindex(keywords.index),
+                              'time_stamp': self.df['timestamp'].reindex(keywords.index),
+                              'keyword': keywords.astype(str)})
+        pairs.insert(0, 'keyword_id', self.hash_ids(pairs['keyword']))
+        return pairs
+
+    def keywords_json(self, pairs):
+        '''
+        JSON arrays of the keywords of each article, json.dumps only runs
+        once per distinct keyword
+        :param pairs: dataframe from keyword_pairs()
+        :return: series of JSON strings indexed like self.df
+        '''
+        codes, uniques = pd.factorize(pairs['keyword'])
+        quoted = np.array([json.dumps(keyword) + ', ' for keyword in uniques], dtype=object)[codes]
+        labels, starts = self.group_starts(pairs)
+        # Concatenate the quoted keywords of each article, without the last separator
+        joined = np.add.reduceat(quoted, starts) if len(starts) else []
+        joined = pd.Series(joined, index=labels, dtype=object).str[:-2].reindex(self.df.index)
+        return '[' + joined.fillna('') + ']'
+
+    def group_starts(self, exploded):
+        '''
+        Exploded rows of an article are consecutive, each article's group
+        starts where the index label changes
+        :param exploded: series or dataframe indexed by article
+        :return: (labels, starts), the article and first position of each group
+        '''
+        labels = exploded.index.values
+        if not len(labels):
+            return labels, np.array([], dtype=np.intp)
+        starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+        return labels[starts], starts
+
+
+    def setup_table(self, sql_cursor):
+        logging.warning('Setting up TABLES and creating INDEX')
+        sql_cursor.execute('''CREATE TABLE IF NOT EXISTS news(
+        time_stamp BIGINT, short_date DATE, snippet TEXT, headline TEXT(200), keywords JSON,
+        news_id BIGINT);''')
+
+        sql_cursor.execute(
+            '''CREATE UNIQUE INDEX idx_news ON news (time_stamp, headline) ''')
+        sql_cursor.execute('''CREATE INDEX idx_news_id ON news (news_id) ''')
+
+    def setup_keyword_tables(self, sql_cursor):
+        logging.warning('Setting up keyword index TABLES')
+        sql_cursor.execute('''CREATE TABLE IF NOT EXISTS keywords(
+        keyword_id BIGINT PRIMARY KEY, keyword VARCHAR(255));''')
+        sql_cursor.execute('''CREATE INDEX idx_keyword ON keywords (keyword) ''')
+        # Keyword first then time: news mentioning a keyword over a date range
+        # is a range scan of the primary key
+        sql_cursor.execute('''CREATE TABLE IF NOT EXISTS news_keywords(
+        keyword_id BIGINT, news_id BIGINT, time_stamp BIGINT,
+        PRIMARY KEY (keyword_id, time_stamp, news_id));''')
+
+    def load_frame(self, pairs=None):
+        frame = ETLPipeline.load_frame(self)
+        frame['keywords'] = self.keywords_json(self.keyword_pairs() if pairs is None else pairs)
+        return frame
+
+    def create_table(self, sql_cursor, table_name):
+        if table_name == self.table_name:
+            self.setup_table(sql_cursor)
+        else:
+            self.setup_keyword_tables(sql_cursor)
+
+    def table_layout(self):
+        return [(self.table_name, self.KEY_COLUMNS, self.DATE_COLUMN),
+                ('keywords', ['keyword_id'], None),
+                ('news_keywords', ['keyword_id', 'time_stamp', 'news_id'], 'time_stamp')]
+
+    def load_tables(self):
+        pairs = self.keyword_pairs()
+        return [(self.table_name, self.load_frame(pairs), self.KEY_COLUMNS, self.DATE_COLUMN),
+                ('keywords', pairs[['keyword_id', 'keyword']].drop_duplicates('keyword_id'),
+                 ['keyword_id'], None),
+                ('news_keywords', pairs[['keyword_id', 'news_id', 'time_stamp']],
+                 ['keyword_id', 'time_stamp', 'news_id'], 'time_stamp')]
@@ -0,0 +1,389 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from credentials import Credentials
+from metrics import PipelineMetrics
+from storage import MySQLBackend, SQLiteBackend
+from http_client import get_client
+
+
+class ETLPipeline(object):
+
+    # List of (table column, dataframe column) pairs fed to the bulk loader
+    COLUMN_MAPPING = []
+    # Columns of the unique index of the table, used for upserts
+    KEY_COLUMNS = []
+    # Date (or epoch seconds) column of the table, rows are stored in its
+    # order and partitioned by it. MySQL partitions only a column of KEY_COLUMNS
+    DATE_COLUMN = None
+    # True when the date columns hold epoch seconds rather than DATEs
+    EPOCH_DATES = False
+    # strptime format of the dates returned by the source
+    DATE_FORMAT = None
+    # Chunk size used in streaming mode when none is given
+    DEFAULT_CHUNK_SIZE = None
+    # Compact dtypes of the staged columns, see staging.StagingArea.downcast
+    STAGING_DTYPES = {}
+    # Partitions of the staged chunks, columns or 'year'/'month' of STAGING_DATE
+    STAGING_PARTITIONS = []
+    STAGING_DATE = None
+    # Rows read back from the staging area per load
+    STAGED_ROWS_PER_LOAD = 100000
+
+    def __init__(self, table_name, batch_size=1000, commit_every=None,
+                 load_mode='executemany', cache=None, incremental=False, pool=None,
+                 streaming=False, chunk_size=None, metrics_dir=None,
+                 profile_threshold=None, trace_memory=False, staging=None,
+                 load_after=None, http=None, backends=None):
+        '''
+        :param table_name: table the pipeline loads into
+        :param batch_size: rows per multi-row INSERT sent by executemany
+        :param commit_every: commit after this many rows. None commits once per load
+        :param load_mode: 'executemany' or 'infile' (LOAD DATA LOCAL INFILE)
+        :param cache: ResponseCache shared by the pipelines, None disables caching
+        :param incremental: only extract and load data newer than what the
+                            table already holds
+        :param pool: ConnectionPool (or db.SQLitePool) to borrow connections from.
+                     Defaults to the pool of the process for the database in Credentials
+        :param streaming: extract, clean, transform and load bounded chunks one
+                          after the other instead of the whole window at once
+        :param chunk_size: size of the chunks: stocks for StockETL, months for
+                           NewsETL and days for ForexETL. None disables chunking
+                           unless streaming is on
+        :param metrics_dir: folder where run() writes <table>.json and <table>.prom
+                            metrics and profile dumps. Metrics are logged either way
+        :param profile_threshold: dump a cProfile of any stage slower than this
+                                  many seconds. None disables profiling
+        :param trace_memory: with profiling, also dump the top allocations
+        :param staging: StagingArea where transformed chunks are written before
+                        being loaded and removed once loaded. Chunks left by a
+                        failed load are loaded by the next run or load_staged()
+        :param load_after: only load data after this mark, in the format of the
+                           high water mark. Data extracted before it only feeds
+                           the stateful transforms (pct changes, indicators)
+        :param http: HttpClient rate limiting, retrying and circuit breaking the
+                     calls to the sources. Defaults to the client of the process
+        :param backends: storage backends every chunk is loaded into at the same
+                         time, e.g. [MySQLBackend(), ColumnarSink('warehouse')].
+                         The high water mark is read from the first one. Defaults
+                         to the database of `pool`, with the load options above
+        '''
+        self.table_name = table_name
+        self.cache = cache
+        self.incremental = incremental
+        if backends is None:
+            backend = SQLiteBackend if getattr(pool, 'dialect', None) == 'sqlite' else MySQLBackend
+            backends = [backend(pool, batch_size=batch_size, commit_every=commit_every,
+                                load_mode=load_mode)]
+        self.backends = list(backends)
+        if incremental and not self.backends[0].keeps_high_water_mark:
+            raise ValueError('Incremental pipelines read the high water mark from their first backend, '
+                             'which {} does not keep'.format(self.backends[0].name))
+        self.streaming = streaming
+        self.chunk_size = chunk_size or (self.DEFAULT_CHUNK_SIZE if streaming else None)
+        # State carried from one chunk to the next by stateful transforms
+        self.carry = None
+        # Data of the current chunk, None until the first chunk is extracted
+        self.df = None
+        self.metrics = PipelineMetrics(table_name, output_dir=metrics_dir,
+                                       profile_threshold=profile_threshold,
+                                       trace_memory=trace_memory)
+        self.timings = {}
+        self.staging = staging
+        self.load_after = load_after
+        self.http = http or get_client()
+        self.high_water_mark = None
+        self.NYTIMES_API_KEY = Credentials.NTYIMTES_API_KEY
+
+    def parse_dates(self, date_column):
+        '''
+        Parse a date column once, vectorized, with the explicit DATE_FORMAT
+        of the source. Timezone aware dates are converted to naive UTC
+        :param date_column: Pandas date string or datetime column
+        :return: datetime64 column
+        '''
+        if not pd.api.types.is_datetime64_any_dtype(date_column):
+            date_column = pd.to_datetime(date_column, format=self.DATE_FORMAT, utc=True)
+        if date_column.dt.tz is not None:
+            date_column = date_column.dt.tz_convert(None)
+        return date_column
+
+    def to_date(self, dates):
+        '''
+        :param dates: datetime64 column from parse_dates
+        :return: datetime64 column truncated to the day
+        '''
+        return dates.dt.normalize()
+
+    def to_timestamp(self, dates):
+        '''
+        :param dates: datetime64 column from parse_dates
+        :return: int64 epoch seconds
+        '''
+        return dates.values.astype('datetime64[s]').astype(np.int64)
+
+    def get_json(self, url, params=None, immutable=False):
+        '''
+        GET a JSON document, going through the response cache when there is one
+        :param immutable: True when the response covers a closed period
+        :return: decoded JSON
+        '''
+        def download():
+            content = self.http.get(url, params)
+            self.metrics.add('extract', requests=1, bytes_downloaded=len(content))
+            return content
+        if self.cache is None:
+            return json.loads(download())
+        return json.loads(self.cache.fetch(url, params, download, immutable))
+
+    def setup_table(self, sql_cursor):
+        pass
+
+    def load_frame(self):
+        '''
+        Dataframe handed to the bulk loader, with table column names.
+        Subclasses override it when values need converting first
+        :return: dataframe with the columns of COLUMN_MAPPING
+        '''
+        frame = self.df[[df_column for _, df_column in self.COLUMN_MAPPING]]
+        return frame.set_axis([column for column, _ in self.COLUMN_MAPPING], axis=1)
+
+    def load_tables(self):
+        '''
+        Tables loaded from self.df by the backends
+        :return: list of (table name, dataframe with the table columns,
+                 key columns, date column)
+        '''
+        return [(self.table_name, self.load_frame(), self.KEY_COLUMNS, self.DATE_COLUMN)]
+
+    def table_layout(self):
+        '''
+        :return: list of (table name, key columns, date column) of the
+                 tables of load_tables(), known before any data
+        '''
+        return [(self.table_name, self.KEY_COLUMNS, self.DATE_COLUMN)]
+
+    def create_table(self, sql_cursor, table_name):
+        '''
+        DDL of a table of load_tables(), run by the SQL backends
+        '''
+        self.setup_table(sql_cursor)
+
+    def create_tables(self, first, last):
+        '''
+        Create the tables in every backend, partitioned from the first to
+        the last day, e.g. before several processes load into them at once
+        '''
+        days = pd.Series(pd.date_range(first, last, freq='D'))
+        dates = pd.Series(self.to_timestamp(days)) if self.EPOCH_DATES else days
+        for backend in self.backends:
+            backend.create_tables(self, dates)
+
+    def extract(self):
+        '''
+        Get the data from google finance API (stock prices),
+        NYTimes API (news data), restapi.io (FOREX data)
+        :return: appended dataframe containing data from all given stocks
+        '''
+        return
+
+    def clean(self):
+        '''
+        Basic cleaning applied by converting data extracted data into
+        dataframes. Reason for using dataframes is to visualize the
+        data at any point during cleaning. Also 'pandas' allows us
+        to clean dataframes very easily
+        :return: cleaned dataframe
+        '''
+        return
+
+    def transform(self):
+        '''
+        Basic transformation is done by adding few important columns.
+        Date columns are also transformed for consistency at later point
+        to query the results easily
+        :return:
+        '''
+        return
+
+    def get_high_water_mark(self, sql_cursor):
+        '''
+        Latest data already stored in the table
+        :param sql_cursor: cursor on an existing table
+        :return: high water mark, None when the table is empty
+        '''
+        return None
+
+    def start_after(self, high_water_mark):
+        '''
+        Narrow the extraction window to data after the high water mark,
+        keeping one bar of overlap so that pct changes stay correct
+        :return: False when there is nothing new to extract
+        '''
+        return True
+
+    def drop_loaded(self, high_water_mark):
+        '''
+        Remove the rows already stored in the table (the overlap) after transform
+        '''
+        pass
+
+    def read_high_water_mark(self):
+        return self.backends[0].high_water_mark(self)
+
+    def load(self):
+        logging.warning('Loading table {}'.format(self.table_name))
+        tables = self.load_tables()
+        if len(self.backends) == 1:
+            self.load_into(self.backends[0], tables)
+        else:
+            # Every backend loads the same frames at the same time
+            with ThreadPoolExecutor(max_workers=len(self.backends)) as executor:
+                futures = [executor.submit(self.load_into, backend, tables) for backend in self.backends]
+            errors = [future.exception() for future in futures if future.exception() is not None]
+            if errors:
+                raise errors[0]
+        logging.warning('Successfully completed loading the data to the {} table'.format(self.table_name))
+
+    def stage(self):
+        '''
+        Write the columns of self.df that get loaded to the staging area
+        :return: paths of the staged files
+        '''
+        columns = [df_column for _, df_column in self.COLUMN_MAPPING]
+        if self.STAGING_DATE is not None and self.STAGING_DATE not in columns:
+            columns.append(self.STAGING_DATE)
+        frame = self.df[columns]
+        return self.staging.write(self.table_name, frame, dtypes=self.STAGING_DTYPES,
+                                  partitions=self.STAGING_PARTITIONS,
+                                  date_column=self.STAGING_DATE)
+
+    def load_into(self, backend, tables):
+        with self.metrics.stage('load_{}'.format(backend.name)) as rows:
+            rows['rows_in'] = rows['rows_out'] = backend.write(self, tables)
+
+    def load_staged(self):
+        '''
+        Load the chunks left in the staging area by a run whose load failed,
+        without extracting them again. Files are removed once loaded
+        :return: number of rows loaded
+        '''
+        loaded = 0
+        for paths, frame in self.staging.iter_chunks(self.table_name, self.STAGED_ROWS_PER_LOAD):
+            self.df = frame
+            self.timed('load', self.load)
+            self.staging.remove(paths)
+            loaded += len(frame)
+        self.df = None
+        logging.warning('Loaded {0} staged rows into {1}'.format(loaded, self.table_name))
+        return loaded
+
+    def extract_chunks(self):
+        '''
+        Yield the extracted data as dataframes, one per chunk. run() loads
+        a chunk while the next one is being extracted. By default the whole
+        extraction is a single chunk
+        '''
+        self.extract()
+        yield self.df
+
+    def rows(self, data=None):
+        data = self.df if data is None else data
+        return 0 if data is None else len(data)
+
+    def timed(self, stage, func, *args):
+        '''
+        Call func(*args) and record it in the metrics of the stage. Rows in and
+        out are the length of self.df before and after, or of the returned chunk
+        '''
+        with self.metrics.stage(stage) as rows:
+            rows['rows_in'] = self.rows() if stage != 'extract' else 0
+            result = func(*args)
+            if isinstance(result, pd.DataFrame):
+                rows['rows_out'] = len(result)
+            elif stage != 'extract':
+                rows['rows_out'] = self.rows()
+        return result
+
+    def produce_chunks(self, chunks, stop):
+        # Runs on a background thread: extraction of the next chunk overlaps
+        # with clean/transform/load of the previous one
+        iterator = self.extract_chunks()
+        try:
+            while not stop.is_set():
+                chunk = self.timed('extract', next, iterator, None)
+                if chunk is None or stop.is_set():
+                    break
+                chunks.put(chunk)
+        except BaseException as e:
+            chunks.put(e)
+            return
+        chunks.put(None)
+
+    def run(self):
+        self.metrics.reset()
+        self.carry = None
+        start = time.perf_counter()
+        if self.staging is not None and self.staging.files(self.table_name):
+            # Chunks a previous run transformed but could not load
+            logging.warning('Loading chunks of {} staged by a previous run'.format(self.table_name))
+            self.load_staged()
+        if self.incremental:
+            self.high_water_mark = self.timed('high_water_mark', self.read_high_water_mark)
+            logging.warning('High water mark of {0}: {1}'.format(self.table_name,
+                                                                self.high_water_mark))
+            if self.high_water_mark is not None and not self.start_after(self.high_water_mark):
+                logging.warning('Table {} is already up to date'.format(self.table_name))
+                self.metrics.emit()
+                self.timings = self.metrics.timings()
+                return self.timings
+
+        chunks = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        producer = threading.Thread(target=self.produce_chunks, args=(chunks, stop),
+                                    name='extract-{}'.format(self.table_name), daemon=True)
+        producer.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                self.df = chunk
+                self.timed('clean', self.clean)
+                self.timed('transform', self.transform)
+                for mark in (self.high_water_mark, self.load_after):
+                    if mark is not None:
+                        self.drop_loaded(mark)
+                if self.staging is not None:
+                    staged = self.timed('stage', self.stage)
+                    self.timed('load', self.load)
+                    self.staging.remove(staged)
+                else:
+                    self.timed('load', self.load)
+                if self.streaming:
+                    # Only one chunk at a time stays in memory
+                    self.df = None
+        finally:
+            # Unblock the producer if a stage failed
+            stop.set()
+            while producer.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        self.metrics.add('total', calls=1, wall_seconds=time.perf_counter() - start)
+        self.metrics.emit()
+        self.timings = self.metrics.timings()
+        logging.warning('Stage timings of {0}: {1}'.format(self.table_name, ', '.join(
+            '{0}={1:.2f}s'.format(stage, seconds) for stage, seconds in self.timings.items())))
+        return self.timings
@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import logging
+import time
+
+
+class PipelineScheduler(object):
+    '''
+    Run ETL pipelines as a DAG. Pipelines without pending dependencies run
+    in parallel threads, a pipeline starts once all its dependencies
+    finished successfully, and dependents of a failed pipeline are skipped.
+    '''
+
+    def __init__(self, max_workers=None):
+        '''
+        :param max_workers: pipelines running at the same time. None runs
+                            every ready pipeline at once
+        '''
+        self.max_workers = max_workers
+        self.pipelines = {}
+        self.dependencies = {}
+        self.timings = {}
+        self.errors = {}
+
+    def add(self, name, pipeline, depends_on=()):
+        '''
+        :param name: unique name of the pipeline in the schedule
+        :param pipeline: ETLPipeline instance
+        :param depends_on: names of the pipelines that must finish first
+        '''
+        if name in self.pipelines:
+            raise ValueError('Pipeline {} is already scheduled'.format(name))
+        self.pipelines[name] = pipeline
+        self.dependencies[name] = set(depends_on)
+        return self
+
+    def check(self):
+        for name, depends_on in self.dependencies.items():
+            unknown = depends_on - set(self.pipelines)
+            if unknown:
+                raise ValueError('Pipeline {0} depends on unknown pipelines {1}'.format(name, sorted(unknown)))
+        # Kahn's algorithm, whatever is left over is part of a cycle
+        remaining = dict((name, set(deps)) for name, deps in self.dependencies.items())
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError('Pipelines {} have cyclic dependencies'.format(sorted(remaining)))
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def run_pipeline(self, name):
+        logging.warning('Starting pipeline {}'.format(name))
+        start = time.perf_counter()
+        timings = self.pipelines[name].run() or {}
+        timings['wall'] = time.perf_counter() - start
+        return timings
+
+    def run(self):
+        '''
+        Run all the pipelines
+        :return: dict name -> stage timings of each successful pipeline
+        :raise RuntimeError: when a pipeline failed or was skipped, after
+                             all the others finished
+        '''
+        self.check()
+        self.timings = {}
+        self.errors = {}
+        done = set()
+        waiting = set(self.pipelines)
+        running = {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(self.pipelines) or 1) as executor:
+            while waiting or running:
+                for name in sorted(waiting):
+                    failed = self.dependencies[name] & set(self.errors)
+                    if failed:
+                        logging.warning('Skipping pipeline {0}, dependencies {1} failed'.format(name, sorted(failed)))
+                        self.errors[name] = RuntimeError('Dependencies {} failed'.format(sorted(failed)))
+                        waiting.discard(name)
+                    elif self.dependencies[name] <= done:
+                        running[executor.submit(self.run_pipeline, name)] = name
+                        waiting.discard(name)
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        self.timings[name] = future.result()
+                        done.add(name)
+                    except Exception as e:
+                        logging.exception('Pipeline {} failed'.format(name))
+                        self.errors[name] = e
+        self.report(time.perf_counter() - start)
+        if self.errors:
+            raise RuntimeError('Pipelines failed: {}'.format(sorted(self.errors)))
+        return self.timings
+
+    def report(self, wall):
+        for name, timings in self.timings.items():
+            logging.warning('{0}: {1}'.format(name, ', '.join(
+                '{0}={1:.2f}s'.format(stage, seconds) for stage, seconds in timings.items())))
+        logging.warning('Ran {0} pipelines in {1:.2f}s'.format(len(self.pipelines), wall))
@@ -0,0 +1,165 @@
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # staging is optional
+    pa = None
+
+
+class StagingArea(object):
+    '''
+    On-disk staging of transformed chunks between the transform and load
+    stages, so that a failed load can be retried without extracting again.
+    Chunks are written as uncompressed Arrow IPC files, which are memory
+    mapped when read back, under <directory>/<table>/<partition>/...
+    with hive style partition folders (e.g. year=2018/StockName=MSFT).
+    '''
+
+    def __init__(self, directory):
+        '''
+        :param directory: folder of the staged files, created if missing
+        '''
+        if pa is None:
+            raise ImportError('pyarrow is required to stage chunks')
+        self.directory = directory
+        self.counter = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+
+    def downcast(self, frame, dtypes):
+        '''
+        :param dtypes: dict column -> dtype, e.g. {'StockName': 'category'}.
+                       'date32' columns are stored as days since epoch
+        :return: arrow table of the frame with the dtypes applied
+        '''
+        dates = [column for column, dtype in dtypes.items() if dtype == 'date32' and column in frame]
+        frame = frame.astype(dict((column, dtype) for column, dtype in dtypes.items()
+                                  if dtype != 'date32' and column in frame))
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        for column in dates:
+            position = table.schema.get_field_index(column)
+            table = table.set_column(position, column, table[column].cast(pa.date32(), safe=False))
+        return table
+
+    def partition_keys(self, frame, partitions, date_column):
+        '''
+        :param partitions: partition names, 'year' and 'month' are taken from date_column
+        :return: list of key series, one per partition
+        '''
+        keys = []
+        for name in partitions:
+            if name == 'year':
+                keys.append(frame[date_column].dt.strftime('%Y'))
+            elif name == 'month':
+                keys.append(frame[date_column].dt.strftime('%Y-%m'))
+            else:
+                keys.append(frame[name].astype(str))
+        return keys
+
+    def write(self, name, frame, dtypes=None, partitions=(), date_column=None):
+        '''
+        Stage a chunk, one file per partition
+        :param name: name of the staged dataset, the table name of the pipeline
+        :param frame: dataframe with a unique index
+        :param dtypes: dtypes applied before writing, see downcast()
+        :param partitions: partition names, columns of the frame or 'year'/'month'
+        :param date_column: datetime64 column the 'year'/'month' partitions come from
+        :return: paths of the files written
+        '''
+        table = self.downcast(frame.reset_index(drop=True), dtypes or {})
+        if partitions:
+            keys = self.partition_keys(frame.reset_index(drop=True), partitions, date_column)
+            groups = pd.Series(range(len(frame))).groupby(keys, sort=False).indices
+        else:
+            groups = {(): range(len(frame))}
+        paths = []
+        sequence = '{0:020d}-{1:06d}'.format(time.time_ns(), next(self.counter))
+        for values, positions in groups.items():
+            values = values if isinstance(values, tuple) else (values,)
+            folder = os.path.join(self.directory, name, *['{0}={1}'.format(partition, value)
+                                                          for partition, value in zip(partitions, values)])
+            paths.append(self._write_file(folder, sequence, table.take(pa.array(positions))))
+        return paths
+
+    def _write_file(self, folder, sequence, table):
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, 'part-{}.arrow'.format(sequence))
+        # Write then rename, a crash never leaves a half written part
+        handle, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        os.close(handle)
+        try:
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return path
+
+    def files(self, name):
+        '''
+        :return: paths of the staged files of a dataset, oldest chunk first
+        '''
+        paths = []
+        for folder, _, names in os.walk(os.path.join(self.directory, name)):
+            paths.extend(os.path.join(folder, file_name) for file_name in names
+                         if file_name.endswith('.arrow'))
+        return sorted(paths, key=os.path.basename)
+
+    def read(self, paths, columns=None):
+        '''
+        Read staged files back, memory mapped. Numeric columns without
+        missing values are not copied
+        :param paths: file paths from write() or files()
+        :param columns: columns to read, None reads all of them
+        :return: dataframe
+        '''
+        tables = [pa.ipc.open_file(pa.memory_map(path)).read_all() for path in paths]
+        if columns is not None:
+            tables = [table.select(columns) for table in tables]
+        return self._to_frame(tables)
+
+    def _to_frame(self, tables):
+        table = pa.concat_tables(tables, promote_options='permissive') if len(tables) > 1 else tables[0]
+        return table.to_pandas(split_blocks=True, date_as_object=False)
+
+    def iter_chunks(self, name, rows=100000):
+        '''
+        Read the staged files of a dataset back in groups of about `rows` rows
+        :return: iterator of (paths, dataframe)
+        '''
+        paths, tables, count = [], [], 0
+        for path in self.files(name):
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            paths.append(path)
+            tables.append(table)
+            count += table.num_rows
+            if count >= rows:
+                yield paths, self._to_frame(tables)
+                paths, tables, count = [], [], 0
+        if tables:
+            yield paths, self._to_frame(tables)
+
+    def remove(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def size(self, name):
+        '''
+        :return: bytes staged for a dataset
+        '''
+        return sum(os.path.getsize(path) for path in self.files(name))
+
+    def clear(self, name):
+        logging.warning('Clearing staged chunks of {}'.format(name))
+        shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
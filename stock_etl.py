@@ -0,0 +1,276 @@
+from datetime import timedelta
+import logging
+import pickle
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from concurrency import ConcurrentExtractor
+from pipeline import ETLPipeline
+
+
+class StockETL(ETLPipeline):
+
+    COLUMN_MAPPING = [('time_stamp', 'Timestamp'), ('stock_name', 'StockName'),
+                      ('price_open', 'Open'), ('price_high', 'High'),
+                      ('price_low', 'Low'), ('price_close', 'Close'),
+                      ('volume', 'Volume'), ('pct_ret', 'pct_change_returns'),
+                      ('pct_vol', 'pct_change_volume')]
+    KEY_COLUMNS = ['time_stamp', 'stock_name']
+    DATE_COLUMN = 'time_stamp'
+    EPOCH_DATES = True
+    # Cache key of the price source, which is a python call and not a URL
+    PRICE_CACHE_URL = 'googlefinance://get_price_data'
+    # Host called by the price source, for the HTTP client quotas
+    PRICE_HOST = 'finance.google.com'
+    # Stocks per chunk in streaming mode
+    DEFAULT_CHUNK_SIZE = 10
+    # Seconds of a trading day, the bars of a day at intraday intervals
+    TRADING_SECONDS = 6 * 3600 + 1800
+    # Calendar days added to the lookback for market holidays, e.g. a Monday
+    # holiday after a weekend or the four day closure of September 2001
+    HOLIDAY_MARGIN_DAYS = 10
+    # Rolling indicators, named <kind>_<window in bars>: ret (return over the
+    # window), vol (std of the 1 bar returns), sma (moving average of the
+    # close) and vwap (volume weighted typical price)
+    INDICATOR_KINDS = ('ret', 'vol', 'sma', 'vwap')
+    STAGING_DTYPES = {'StockName': 'category', 'Short_date': 'date32'}
+    STAGING_PARTITIONS = ['year', 'StockName']
+    STAGING_DATE = 'Short_date'
+
+    def __init__(self, stocks, interval, stock_market, period, price_source=None,
+                 max_workers=4, requests_per_second=2.0, retries=3, timeout=None, symbol_timeout=120.0,
+                 indicators=(), start_date=None, end_date=None, **kwargs):
+        '''
+        :param price_source: callable taking the Google Finance query params and
+                             returning a price dataframe. Defaults to
+                             googlefinance.client.get_price_data
+        :param max_workers: number of symbols fetched concurrently
+        :param requests_per_second: rate limit of the price source
+        :param retries: retries per symbol, with exponential backoff
+        :param timeout: seconds to wait for all symbols before giving up on the rest
+        :param symbol_timeout: seconds a symbol may take, retries included. The
+                               price source has no socket timeout, a hung
+                               download is reported as failed after it
+        :param indicators: rolling indicators to compute per stock, e.g.
+                           ['ret_5', 'vol_20', 'sma_50', 'vwap_20']. Each one
+                           is stored in a FLOAT column of the same name
+        :param start_date: first day of the bars kept from the price source,
+                           None keeps the whole period
+        :param end_date: last day of the bars kept, None keeps up to today
+        '''
+        ETLPipeline.__init__(self, table_name='stock_ticks', **kwargs)
+        self.indicators = [self.parse_indicator(name) for name in indicators]
+        self.COLUMN_MAPPING = StockETL.COLUMN_MAPPING + [(name, name) for name, _, _ in self.indicators]
+        # Bars of history each stock needs before its first new bar
+        self.lookback = max([1] + [window for _, _, window in self.indicators])
+        self.stocks = stocks
+        self.interval = interval
+        self.stock_market = stock_market
+        self.period = period
+        self.start_date = start_date
+        self.end_date = end_date
+        # googlefinance is imported when the first stock is fetched
+        self.price_source = price_source
+        # Per stock period, narrowed by incremental runs
+        self.periods = {}
+        self.max_workers = max_workers
+        self.http.configure(self.PRICE_HOST, requests_per_second, burst=max_workers, retries=retries)
+        self.timeout = timeout
+        self.symbol_timeout = symbol_timeout
+        self.failed_stocks = {}
+
+    def parse_indicator(self, name):
+        '''
+        :param name: indicator name, e.g. 'vol_20'
+        :return: (name, kind, window)
+        :raise ValueError: on unknown kinds or windows too short for the kind
+        '''
+        match = re.match(r'^([a-z]+)_(\d+)$', name)
+        if match is None or match.group(1) not in self.INDICATOR_KINDS:
+            raise ValueError('Unknown indicator {0}, expected <kind>_<window> with kind in {1}'.format(
+                name, self.INDICATOR_KINDS))
+        kind, window = match.group(1), int(match.group(2))
+        if window < (2 if kind == 'vol' else 1):
+            raise ValueError('Window of indicator {} is too short'.format(name))
+        return name, kind, window
+
+    def get_prices(self, param):
+        if self.price_source is None:
+            from googlefinance.client import get_price_data
+            self.price_source = get_price_data
+        return self.price_source(param)
+
+    def get_stock_data(self, stock):
+        param = {
+            'q': stock,
+            'i': self.interval,
+            'x': self.stock_market,
+            'p': self.periods.get(stock, self.period)
+        }
+        logging.warning('Getting data from Google Finance API. Current stock {}'.format(stock))
+        def download():
+            self.metrics.add('extract', requests=1)
+            return self.http.call(self.PRICE_HOST, self.get_prices, (param,))
+        if self.cache is None:
+            sub_df = download()
+        else:
+            # The period is relative to today so bars are never immutable
+            sub_df = pickle.loads(self.cache.fetch(self.PRICE_CACHE_URL, param,
+                                                   lambda: pickle.dumps(download())))
+        # Google Finance periods count back from today, other windows are cut here
+        if self.start_date is not None:
+            sub_df = sub_df[sub_df.index >= pd.Timestamp(self.start_date)]
+        if self.end_date is not None:
+            sub_df = sub_df[sub_df.index < pd.Timestamp(self.end_date + timedelta(1))]
+        sub_df['StockName'] = stock
+        return sub_df
+
+    def extractor(self):
+        # Rate limits and retries are done by the HTTP client
+        return ConcurrentExtractor(self.get_stock_data,
+                                   max_workers=self.max_workers,
+                                   retries=0,
+                                   timeout=self.timeout,
+                                   item_timeout=self.symbol_timeout)
+
+    def extract(self):
+        frames, self.failed_stocks = self.extractor().run(self.stocks)
+        if not frames:
+            raise RuntimeError('Could not get data for any of the stocks {}'.format(self.stocks))
+        if self.failed_stocks:
+            logging.warning('Skipping stocks without data: {}'.format(sorted(self.failed_stocks)))
+        # Keep the order of self.stocks and copy the data once
+        self.df = pd.concat([frames[stock] for stock in self.stocks if stock in frames])
+
+    def extract_chunks(self):
+        if not self.chunk_size:
+            yield from ETLPipeline.extract_chunks(self)
+            return
+        # Stocks are yielded in the order they finish downloading. The next
+        # stock is only downloaded as chunks are consumed, so memory stays
+        # bounded by the chunk size however slow the load is
+        self.failed_stocks = {}
+        frames = []
+        results = self.extractor().iter_results(self.stocks, self.failed_stocks,
+                                                max_pending=self.chunk_size + self.max_workers)
+        for stock, frame in results:
+            frames.append(frame)
+            if len(frames) == self.chunk_size:
+                yield pd.concat(frames)
+                frames = []
+        if frames:
+            yield pd.concat(frames)
+        if self.failed_stocks:
+            logging.warning('Skipping stocks without data: {}'.format(sorted(self.failed_stocks)))
+
+    def get_high_water_mark(self, sql_cursor):
+        sql_cursor.execute('''SELECT stock_name, MAX(time_stamp) FROM stock_ticks
+                              GROUP BY stock_name''')
+        marks = dict(sql_cursor.fetchall())
+        return marks or None
+
+    def start_after(self, high_water_mark):
+        now = time.time()
+        for stock in self.stocks:
+            if stock in high_water_mark:
+                # Google Finance periods count days back from today. The
+                # extra days keep the last stored bars as overlap, enough
+                # of them to fill the indicator windows
+                days = int((now - high_water_mark[stock]) // 86400) + 1 + self.lookback_days()
+                self.periods[stock] = '{}d'.format(days)
+        return True
+
+    def lookback_days(self):
+        # Calendar days spanning self.lookback bars: weekends, then a margin for
+        # the holidays and closures in between
+        bars_per_day = max(self.TRADING_SECONDS // int(self.interval), 1)
+        return int(np.ceil(self.lookback / float(bars_per_day) * 7 / 5 * 1.1)) + self.HOLIDAY_MARGIN_DAYS
+
+    def drop_loaded(self, high_water_mark):
+        stored = self.df['StockName'].map(high_water_mark)
+        self.df = self.df[~(self.df['Timestamp'] <= stored)]
+
+    def clean(self):
+        logging.warning('Starting to clean Stock data...')
+        # Check for NANs and replace them by column average
+        check = self.df.isnull().values.any()
+        if check:
+            mean = self.df.mean # mean of each column of the dataframe
+            replace_values = {'Open': mean[0], 'High': mean[1], 'Low': mean[2],
+                              'Close': mean[3], 'Volume':mean[4] }
+            self.df = self.df.fillna(value=replace_values)
+        # Converting stock values to float and Volumes to int
+        # Usually not required
+        self.df[['Open', 'High', 'Low',  'Close']] = \
+            self.df[['Open', 'High', 'Low',  'Close']].astype(float)
+        self.df['Volume'] = self.df['Volume'].astype(int)
+
+
+
+    def transform(self):
+        logging.warning('Performing data transformation')
+        # Resetting the index to column because we have to use
+        # this data to load to database
+        self.df.index.name = 'Date'
+        self.df = self.df.reset_index()
+        dates = self.parse_dates(self.df['Date'])
+        self.df['Short_date'] = self.to_date(dates)
+        self.df['Timestamp'] = self.to_timestamp(dates)
+        del self.df['Date'] # Delete Date column b/c it is not required now
+
+        # Rows are grouped by stock in order of appearance: shifts and windows
+        # never cross from one stock to the next. A chunk holds whole stocks,
+        # so no bars are needed from the previous chunk
+        grouped = self.df.groupby('StockName', sort=False)
+        previous = grouped[['Close', 'Volume']].shift(1)
+
+        # Making 2 new columns
+        # Percentage change in price and volume
+        self.df['pct_change_returns'] = (self.df['Open'] /
+                            previous['Close'] - 1).fillna(0)
+
+        self.df['pct_change_volume'] =  (self.df['Volume'] /
+                            previous['Volume'] - 1).fillna(0)
+
+        self.add_indicators(grouped, previous['Close'])
+
+    def add_indicators(self, grouped, previous_close):
+        '''
+        Compute the rolling indicators of all the stocks at once. Windows are
+        per stock and stay empty (NULL) until a stock has enough bars
+        :param grouped: self.df grouped by StockName
+        :param previous_close: close of the previous bar of the same stock
+        '''
+        keys = self.df['StockName']
+        returns = self.df['Close'] / previous_close - 1
+        typical_volume = (self.df['High'] + self.df['Low'] + self.df['Close']) / 3 * self.df['Volume']
+
+        def rolling(values, window, how):
+            windows = values.groupby(keys, sort=False).rolling(window)
+            # groupby().rolling() prepends the stock to the index, drop it to align with self.df
+            return getattr(windows, how)().reset_index(level=0, drop=True)
+
+        for name, kind, window in self.indicators:
+            if kind == 'ret':
+                self.df[name] = self.df['Close'] / grouped['Close'].shift(window) - 1
+            elif kind == 'vol':
+                self.df[name] = rolling(returns, window, 'std')
+            elif kind == 'sma':
+                self.df[name] = rolling(self.df['Close'], window, 'mean')
+            elif kind == 'vwap':
+                self.df[name] = (rolling(typical_volume, window, 'sum') /
+                                 rolling(self.df['Volume'], window, 'sum'))
+
+
+
+    def setup_table(self, sql_cursor):
+        logging.warning('Setting up TABLES and creating INDEX')
+        sql_cursor.execute('''CREATE TABLE IF NOT EXISTS stock_ticks(
+		time_stamp BIGINT, stock_name VARCHAR(6), price_open FLOAT, price_high FLOAT,
+        price_low FLOAT, price_close FLOAT, volume BIGINT, pct_ret FLOAT, pct_vol FLOAT{});'''.format(
+            ''.join(', {} FLOAT'.format(name) for name, _, _ in self.indicators)))
+
+        sql_cursor.execute('''CREATE UNIQUE INDEX idx_stocks ON stock_ticks (time_stamp, stock_name) ''')
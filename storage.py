@@ -0,0 +1,435 @@
+import calendar
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from bulk_load import BulkLoader
+from credentials import Credentials
+from db import SQLitePool, get_pool
+
+# pyarrow is imported by the first ColumnarSink, the sink is optional
+pa = pq = None
+
+
+PARTITION_FORMATS = {'year': '%Y', 'month': '%Y-%m'}
+
+
+def import_pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('pyarrow is required by the columnar sink')
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def to_datetimes(column):
+    '''
+    :param column: datetime64 column or epoch seconds
+    :return: datetime64 column
+    '''
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column
+    return pd.to_datetime(column, unit='s')
+
+
+class SQLBackend(object):
+    '''
+    Storage of the pipelines in a SQL database, loaded through a
+    ConnectionPool with BulkLoader upserts. Tables are created with the DDL
+    of the pipeline the first time they are loaded, and every chunk is
+    appended in date order.
+    '''
+
+    name = 'sql'
+    # Incremental pipelines read their high water mark from their first backend
+    keeps_high_water_mark = True
+
+    def __init__(self, pool, batch_size=1000, commit_every=None, load_mode='executemany', name=None):
+        '''
+        :param pool: ConnectionPool (or SQLitePool) of the database
+        :param batch_size: rows per multi-row INSERT sent by executemany
+        :param commit_every: commit after this many rows. None commits once per table
+        :param load_mode: 'executemany' or 'infile' (LOAD DATA LOCAL INFILE, MySQL only)
+        :param name: name of the backend in the metrics, defaults to the dialect
+        '''
+        self.pool = pool
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.load_mode = load_mode
+        self.name = name or self.name
+
+    def high_water_mark(self, pipeline):
+        '''
+        :return: high water mark of the table of the pipeline, None when empty or missing
+        '''
+        with self.pool.connection() as conn:
+            if not self.pool.table_exists(conn, pipeline.table_name):
+                return None
+            pipeline.metrics.add('high_water_mark', db_round_trips=1)
+            cur = conn.cursor()
+            try:
+                return pipeline.get_high_water_mark(cur)
+            finally:
+                cur.close()
+
+    def write(self, pipeline, tables):
+        '''
+        :param tables: list of (table name, frame, key columns, date column)
+                       from pipeline.load_tables()
+        :return: rows loaded into the first table
+        '''
+        counts = []
+        with self.pool.connection() as conn:
+            for table_name, frame, key_columns, date_column in tables:
+                if date_column is not None:
+                    # Rows land in date order, next to the rows of the same days
+                    frame = frame.sort_values(date_column, kind='stable')
+                if not self.pool.table_exists(conn, table_name):
+                    self.create_table(conn, pipeline, table_name, frame, key_columns, date_column)
+                self.prepare(conn, table_name, frame, key_columns, date_column)
+                counts.append(self.append(conn, table_name, frame, key_columns, pipeline.metrics))
+        return counts[0] if counts else 0
+
+    def create_tables(self, pipeline, dates):
+        '''
+        Create the missing tables of a pipeline and the partitions of the dates
+        :param dates: every day to partition, in the type of the date columns
+        '''
+        with self.pool.connection() as conn:
+            for table_name, key_columns, date_column in pipeline.table_layout():
+                frame = pd.DataFrame({date_column: dates} if date_column else {})
+                if not self.pool.table_exists(conn, table_name):
+                    self.create_table(conn, pipeline, table_name, frame, key_columns, date_column)
+                self.prepare(conn, table_name, frame, key_columns, date_column)
+
+    def create_table(self, conn, pipeline, table_name, frame, key_columns, date_column):
+        cur = conn.cursor()
+        pipeline.create_table(cur, table_name)
+        conn.commit()
+        cur.close()
+        self.pool.add_table(table_name)
+
+    def prepare(self, conn, table_name, frame, key_columns, date_column):
+        '''
+        Called before a frame is appended to a table, e.g. to add the date
+        partitions the frame needs
+        '''
+        pass
+
+    def append(self, conn, table_name, frame, key_columns, metrics):
+        '''
+        Upsert a dataframe whose columns are the table columns
+        :return: number of rows sent
+        '''
+        loader = BulkLoader(conn, table_name,
+                            columns=list(frame.columns),
+                            key_columns=key_columns,
+                            batch_size=self.batch_size,
+                            commit_every=self.commit_every,
+                            mode=self.load_mode,
+                            dialect=self.pool.dialect)
+        try:
+            return loader.load(frame)
+        finally:
+            metrics.add('load', db_round_trips=loader.round_trips)
+
+
+class MySQLBackend(SQLBackend):
+    '''
+    MySQL database. Tables with a date column are RANGE partitioned by year
+    (or month) when created, and the partitions of new periods are split
+    from the catch-all `pmax` partition before their rows are loaded. Rows
+    before the first partition go to it. Tables created unpartitioned, e.g.
+    by an older version, are left as they are. MySQL needs the partition
+    column in the unique index, so tables whose date column is not one of
+    their key columns are not partitioned.
+    '''
+
+    name = 'mysql'
+
+    def __init__(self, pool=None, partition='year', **kwargs):
+        '''
+        :param pool: ConnectionPool, defaults to the pool of the database in Credentials
+        :param partition: 'year', 'month' or None to not partition the tables
+        '''
+        if pool is None:
+            pool = get_pool(Credentials, local_infile=kwargs.get('load_mode') == 'infile')
+        SQLBackend.__init__(self, pool, **kwargs)
+        if partition is not None and partition not in PARTITION_FORMATS:
+            raise ValueError('Partition should be one of {}'.format(sorted(PARTITION_FORMATS)))
+        self.partition = partition
+        # Table name -> names of its partitions, empty when not partitioned
+        self.partitions = {}
+
+    def partition_bounds(self, frame, date_column):
+        '''
+        :return: list of (partition name, exclusive upper bound) covering the dates of the frame
+        '''
+        column = frame[date_column]
+        periods = to_datetimes(column).dt.to_period('Y' if self.partition == 'year' else 'M').dropna().unique()
+        bounds = []
+        for period in sorted(periods):
+            end = (period + 1).start_time
+            # DATE columns are partitioned by RANGE COLUMNS, epoch seconds by RANGE
+            bound = ("'{}'".format(end.date()) if pd.api.types.is_datetime64_any_dtype(column)
+                     else str(calendar.timegm(end.timetuple())))
+            bounds.append(('p' + period.strftime(PARTITION_FORMATS[self.partition].replace('-', '')), bound))
+        return bounds
+
+    def partition_sql(self, bounds):
+        return ', '.join(['PARTITION {0} VALUES LESS THAN ({1})'.format(name, bound) for name, bound in bounds] +
+                         ['PARTITION pmax VALUES LESS THAN (MAXVALUE)'])
+
+    def partitioned(self, frame, key_columns, date_column):
+        return (self.partition is not None and date_column is not None
+                and date_column in key_columns and len(frame) > 0)
+
+    def create_table(self, conn, pipeline, table_name, frame, key_columns, date_column):
+        SQLBackend.create_table(self, conn, pipeline, table_name, frame, key_columns, date_column)
+        if not self.partitioned(frame, key_columns, date_column):
+            return
+        bounds = self.partition_bounds(frame, date_column)
+        function = 'RANGE COLUMNS' if pd.api.types.is_datetime64_any_dtype(frame[date_column]) else 'RANGE'
+        logging.warning('Partitioning table {0} by {1}'.format(table_name, self.partition))
+        cur = conn.cursor()
+        cur.execute('''ALTER TABLE {0} PARTITION BY {1} ({2}) ({3})'''.format(
+            table_name, function, date_column, self.partition_sql(bounds)))
+        conn.commit()
+        cur.close()
+        self.partitions[table_name] = set(name for name, _ in bounds) | {'pmax'}
+
+    def existing_partitions(self, conn, table_name):
+        if table_name not in self.partitions:
+            cur = conn.cursor()
+            cur.execute('''SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+                           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s''', (table_name,))
+            self.partitions[table_name] = set(name for name, in cur.fetchall() if name is not None)
+            cur.close()
+        return self.partitions[table_name]
+
+    def prepare(self, conn, table_name, frame, key_columns, date_column):
+        if not self.partitioned(frame, key_columns, date_column):
+            return
+        existing = self.existing_partitions(conn, table_name)
+        if 'pmax' not in existing:
+            return
+        last = max([name for name in existing if name != 'pmax'] or [''])
+        bounds = [(name, bound) for name, bound in self.partition_bounds(frame, date_column) if name > last]
+        if not bounds:
+            return
+        logging.warning('Adding partitions {0} to table {1}'.format(
+            ', '.join(name for name, _ in bounds), table_name))
+        cur = conn.cursor()
+        cur.execute('''ALTER TABLE {0} REORGANIZE PARTITION pmax INTO ({1})'''.format(
+            table_name, self.partition_sql(bounds)))
+        conn.commit()
+        cur.close()
+        existing.update(name for name, _ in bounds)
+
+
+class SQLiteBackend(SQLBackend):
+    '''
+    SQLite file, for development, benchmarks and small deployments. The
+    database runs in WAL mode with one transaction per table and chunk.
+    SQLite has no table partitions: chunks are appended in date order so
+    that a date range is read from neighbouring pages.
+    '''
+
+    name = 'sqlite'
+
+    def __init__(self, database, **kwargs):
+        '''
+        :param database: path of the SQLite file, or a SQLitePool
+        '''
+        pool = SQLitePool(database) if isinstance(database, str) else database
+        SQLBackend.__init__(self, pool, **kwargs)
+
+
+def plain_keys(table):
+    '''
+    :return: arrow table with the dictionary columns (pandas categories) decoded, as joins need
+    '''
+    for position, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(position, field.name, table[field.name].cast(field.type.value_type))
+    return table
+
+
+class ColumnarSink(object):
+    '''
+    Analytical copy of the tables as Parquet files partitioned by date,
+    <directory>/<table>/year=2017/part-<hash>.parquet. Rows are sorted by
+    date then key, so readers skip the partitions and row groups outside a
+    date range. DuckDB queries the files directly:
+
+        SELECT stock_name, AVG(price_close) FROM read_parquet('warehouse/stock_ticks/*/*.parquet',
+        hive_partitioning = true) WHERE year = 2017 GROUP BY stock_name
+
+    Rows whose key is already in a file of their partition are skipped, so
+    a chunk loaded twice (e.g. a staged chunk retried after another backend
+    failed) adds no rows, and a file is named after the hash of the keys of
+    its rows. Each load appends a file per partition, and once a partition
+    has more than `max_files` files they are merged into one, so that nightly
+    loads neither pile up small files nor read more and more keys. Readers
+    may see the rows of a partition twice while it is being merged.
+    '''
+
+    name = 'columnar'
+    keeps_high_water_mark = False
+
+    def __init__(self, directory, partition='year', compression='zstd', row_group_size=100000, name=None,
+                 max_files=16):
+        '''
+        :param directory: folder of the tables, created if missing
+        :param partition: 'year', 'month' or None to not partition the tables
+        :param compression: Parquet codec
+        :param row_group_size: rows per row group, the unit readers skip
+        :param name: name of the backend in the metrics
+        :param max_files: files of a partition merged into one once there are more
+        '''
+        import_pyarrow()
+        if partition is not None and partition not in PARTITION_FORMATS:
+            raise ValueError('Partition should be one of {}'.format(sorted(PARTITION_FORMATS)))
+        self.directory = directory
+        self.partition = partition
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.name = name or self.name
+        self.max_files = max_files
+        os.makedirs(directory, exist_ok=True)
+
+    def create_tables(self, pipeline, dates):
+        # Folders are created by the files written into them
+        pass
+
+    def high_water_mark(self, pipeline):
+        raise NotImplementedError('The columnar sink keeps no high water mark, '
+                                  'incremental pipelines need a SQL backend first')
+
+    def write(self, pipeline, tables):
+        '''
+        :param tables: list of (table name, frame, key columns, date column)
+                       from pipeline.load_tables()
+        :return: rows written to the first table
+        '''
+        counts = [self.append(table_name, frame, key_columns, date_column)
+                  for table_name, frame, key_columns, date_column in tables]
+        return counts[0] if counts else 0
+
+    def append(self, table_name, frame, key_columns=(), date_column=None):
+        '''
+        Write a dataframe to a table, one file per partition
+        :param key_columns: rows whose key is already stored are skipped
+        :return: number of rows written
+        '''
+        if not len(frame):
+            return 0
+        order = ([date_column] if date_column else []) + [key for key in key_columns if key != date_column]
+        if order:
+            frame = frame.sort_values(order)
+        frame = frame.reset_index(drop=True)
+        table = self.to_arrow(frame)
+        if date_column is None or self.partition is None:
+            groups = {None: np.arange(len(frame))}
+        else:
+            keys = to_datetimes(frame[date_column]).dt.strftime(PARTITION_FORMATS[self.partition])
+            groups = pd.Series(np.arange(len(frame))).groupby(keys.values).indices
+        written = 0
+        for value, positions in groups.items():
+            folder = os.path.join(self.path(table_name),
+                                  *([] if value is None else ['{0}={1}'.format(self.partition, value)]))
+            part = table.take(pa.array(positions))
+            if key_columns:
+                part = self.new_rows(folder, part, list(key_columns))
+            if not part.num_rows:
+                continue
+            self._write_file(folder, self.file_name(part, key_columns), part)
+            written += part.num_rows
+            self.compact(folder, order, list(key_columns))
+        return written
+
+    def file_name(self, table, key_columns):
+        identity = table.select(list(key_columns)) if key_columns else table
+        digest = hashlib.sha1(pd.util.hash_pandas_object(identity.to_pandas(), index=False).values.tobytes())
+        return 'part-{}.parquet'.format(digest.hexdigest()[:20])
+
+    def compact(self, folder, order, key_columns):
+        '''
+        Merge the files of a partition into one once there are more than
+        max_files. Rows stored twice, e.g. by a merge that was interrupted
+        before removing the files it merged, are kept once
+        '''
+        paths = sorted(glob.glob(os.path.join(folder, 'part-*.parquet')))
+        if len(paths) <= self.max_files:
+            return
+        table = pa.concat_tables([pq.read_table(path) for path in paths], promote_options='permissive')
+        if key_columns:
+            keys = plain_keys(table.select(key_columns)).to_pandas()
+            table = table.filter(pa.array(~keys.duplicated(keep='last').values))
+        if order:
+            keys = plain_keys(table.select(order)).append_column('__position', pa.array(np.arange(table.num_rows)))
+            positions = keys.sort_by([(column, 'ascending') for column in order])['__position']
+            table = table.take(positions)
+        merged = self.file_name(table, key_columns)
+        self._write_file(folder, merged, table)
+        for path in paths:
+            if os.path.basename(path) != merged:
+                os.remove(path)
+
+    def new_rows(self, folder, table, key_columns):
+        '''
+        :param table: arrow table of rows to write to the folder
+        :return: the rows of the table whose key is in none of the files of the folder
+        '''
+        paths = sorted(glob.glob(os.path.join(folder, 'part-*.parquet')))
+        if not paths:
+            return table
+        keys = plain_keys(table.select(key_columns))
+        # e.g. pandas strings come as large_string, Parquet reads back string
+        stored = pa.concat_tables([plain_keys(pq.read_table(path, columns=key_columns)).cast(keys.schema)
+                                   for path in paths])
+        keys = keys.append_column('__position', pa.array(np.arange(table.num_rows)))
+        new = keys.join(stored, key_columns, join_type='left anti')
+        return table.take(pa.array(np.sort(new['__position'].to_numpy())))
+
+    def to_arrow(self, frame):
+        # Every datetime column we load is a DATE, as in the SQL tables
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        for position, field in enumerate(table.schema):
+            if pa.types.is_timestamp(field.type):
+                table = table.set_column(position, field.name, table[field.name].cast(pa.date32(), safe=False))
+        return table
+
+    def _write_file(self, folder, file_name, table):
+        os.makedirs(folder, exist_ok=True)
+        # Write then rename, readers never see half a file
+        handle, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        os.close(handle)
+        try:
+            pq.write_table(table, tmp_path, compression=self.compression,
+                           row_group_size=self.row_group_size)
+            os.replace(tmp_path, os.path.join(folder, file_name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def path(self, table_name):
+        return os.path.join(self.directory, table_name)
+
+    def read(self, table_name, columns=None, filters=None):
+        '''
+        :param columns: columns to read, None reads all of them
+        :param filters: pyarrow filters, e.g. [('year', '=', 2017)] or
+                        [('time_stamp', '>=', 1483228800)]
+        :return: dataframe, with the partition column
+        '''
+        return pq.read_table(self.path(table_name), columns=columns, filters=filters,
+                             partitioning='hive').to_pandas()
@@ -0,0 +1,69 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from concurrency import ConcurrentExtractor
+
+
+def test_max_pending_bounds_submitted_items():
+    started = []
+    lock = threading.Lock()
+
+    def fetch(item):
+        with lock:
+            started.append(item)
+        return item
+
+    results = ConcurrentExtractor(fetch, max_workers=2, retries=0).iter_results(range(20), max_pending=3)
+    consumed = []
+    for item, result in results:
+        consumed.append(result)
+        # Only consumed items are replaced by new submissions
+        assert len(started) <= len(consumed) + 3
+    assert sorted(consumed) == list(range(20))
+
+
+def test_failures_are_reported():
+    def fetch(item):
+        if item == 2:
+            raise IOError('down')
+        return item
+
+    results, failures = ConcurrentExtractor(fetch, retries=0).run(range(4))
+    assert sorted(results) == [0, 1, 3]
+    assert list(failures) == [2]
+
+
+def test_item_timeout_reports_hung_items():
+    release = threading.Event()
+
+    def fetch(item):
+        if item == 'hung':
+            release.wait(5)
+        return item
+
+    extractor = ConcurrentExtractor(fetch, max_workers=2, retries=0, item_timeout=0.2)
+    try:
+        results, failures = extractor.run(['a', 'hung', 'b', 'c'])
+    finally:
+        release.set()
+    assert sorted(results) == ['a', 'b', 'c']
+    assert isinstance(failures['hung'], TimeoutError)
+
+
+def test_every_worker_stuck_fails_the_rest():
+    release = threading.Event()
+
+    def fetch(item):
+        release.wait(5)
+        return item
+
+    extractor = ConcurrentExtractor(fetch, max_workers=1, retries=0, item_timeout=0.2)
+    try:
+        results, failures = extractor.run(['a', 'b'])
+    finally:
+        release.set()
+    assert results == {}
+    assert sorted(failures) == ['a', 'b']
@@ -0,0 +1,134 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from http_client import CircuitBreaker, CircuitOpenError, HttpClient, RetryableError
+
+
+def expire(breaker):
+    # As if reset_timeout seconds went by since the circuit opened
+    breaker.opened -= breaker.reset_timeout
+
+
+def opened_breaker():
+    breaker = CircuitBreaker('host', failure_threshold=2, reset_timeout=60.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_threshold():
+    breaker = CircuitBreaker('host', failure_threshold=2)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_success_resets_failures():
+    breaker = CircuitBreaker('host', failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = opened_breaker()
+    expire(breaker)
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_trial_success_closes():
+    breaker = opened_breaker()
+    expire(breaker)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+    breaker.allow()
+
+
+def test_trial_failure_reopens():
+    breaker = opened_breaker()
+    expire(breaker)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_released_trial_lets_the_next_call_through():
+    breaker = opened_breaker()
+    expire(breaker)
+    breaker.allow()
+    breaker.release()
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_release_when_closed_does_nothing():
+    breaker = CircuitBreaker('host')
+    breaker.release()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+
+
+def client():
+    return HttpClient(retries=0, backoff=0, default_rate=1e6, failure_threshold=1, reset_timeout=60.0)
+
+
+def half_open(http, url):
+    with pytest.raises(RetryableError):
+        http.call(url, raise_status(503), exceptions=(RetryableError,))
+    breaker = http.host(url).breaker
+    assert breaker.state == CircuitBreaker.OPEN
+    expire(breaker)
+    return breaker
+
+
+def raise_status(status):
+    def func():
+        raise RetryableError('http://host/', status, retry_after=0.001)
+    return func
+
+
+def test_throttled_trial_does_not_block_the_host():
+    http = client()
+    breaker = half_open(http, 'http://host/')
+    with pytest.raises(RetryableError):
+        http.call('http://host/', raise_status(429), exceptions=(RetryableError,))
+    assert http.call('http://host/', lambda: 'ok') == 'ok'
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_interrupted_trial_does_not_block_the_host():
+    http = client()
+    half_open(http, 'http://host/')
+
+    def interrupted():
+        raise KeyboardInterrupt()
+    with pytest.raises(KeyboardInterrupt):
+        http.call('http://host/', interrupted, exceptions=(RetryableError,))
+    assert http.call('http://host/', lambda: 'ok') == 'ok'
+
+
+def test_answered_trial_closes():
+    http = client()
+    breaker = half_open(http, 'http://host/')
+
+    def not_found():
+        raise LookupError('404')
+    with pytest.raises(LookupError):
+        http.call('http://host/', not_found, exceptions=(RetryableError,))
+    assert breaker.state == CircuitBreaker.CLOSED